@@ -0,0 +1,330 @@
+# ----------------------------------------------------------------------------#
+# JSON API.
+# ----------------------------------------------------------------------------#
+#  /api/v1 serves the data of the HTML pages as JSON:
+#
+#    GET /api/v1/users/latest            latest sign ups (home page)
+#    GET /api/v1/venues                  venues, with num_upcoming_shows
+#    GET /api/v1/artists                 artists, with num_upcoming_shows
+#    GET /api/v1/venues/<id>             venue profile
+#    GET /api/v1/artists/<id>            artist profile
+#    GET /api/v1/shows                   upcoming shows
+#    GET /api/v1/calendar?city=&state=&week=2031-W23
+#                                        shows of a city in an ISO week
+#    POST /api/v1/shows                  books a batch of shows, see
+#                                        schedule() below
+#    GET /api/v1/venues/search?q=term    venues search
+#    GET /api/v1/artists/search?q=term   artists search
+#    GET /api/v1/shows/search?q=term     shows search
+#    GET /api/v1/venues/near?lat=&lon=&km=
+#                                        venues within km of a point
+#                                        (or of city=&state=), closest first
+#    GET /api/v1/venues/within?bbox=south,west,north,east
+#                                        venues inside a box
+#
+#  Lists take 'limit' and the 'after' cursor returned as 'next_cursor'
+#  by the previous page ('page' for the ranked venue/artist searches).
+#  'fields=name,city' returns only those fields; on lists, only their
+#  columns are selected. Responses carry an ETag and answer
+#  If-None-Match with 304 Not Modified.
+#
+#  The blueprint is exempt from CSRF protection (app.py): its only write,
+#  POST /api/v1/shows, takes a JSON body that a cross-site form cannot
+#  send.
+# ----------------------------------------------------------------------------#
+
+from datetime import datetime
+from flask import Blueprint, abort, current_app, jsonify, request
+from sqlalchemy.exc import IntegrityError
+from models import db, Users, Shows
+from queries import (
+    Artist_user,
+    Venue_user,
+    SHOW_COLUMNS,
+    SHOW_FIELDS,
+    USER_COLUMNS,
+    todays_datetime,
+    count_upcoming_shows,
+    page_users,
+    page_shows
+)
+from search import search_users
+from cache import cached_profile, invalidate_profiles
+from sign_ups import FIELDS as SIGN_UP_FIELDS, sign_up_feed
+from geo import gazetteer, venues_near, venues_in_box
+from scheduling import schedule_shows
+from show_calendar import calendar, parse_week
+
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+USER_FIELDS = ('name', 'city', 'state', 'image_link', 'num_upcoming_shows')
+
+
+def requested_fields(allowed, default):
+    ''' Fields of the 'fields' query argument, 400 if one is unknown '''
+    fields = request.args.get('fields')
+    if not fields:
+        return list(default)
+    fields = fields.split(',')
+    if not set(fields).issubset(allowed):
+        abort(400, f'fields must be in: {", ".join(sorted(allowed))}')
+    return fields
+
+
+def page_size():
+    limit = request.args.get('limit', type=int)
+    if not limit or limit < 1:
+        limit = current_app.config['API_PAGE_SIZE']
+    return min(limit, current_app.config['MAX_API_PAGE_SIZE'])
+
+
+def as_json(row):
+    data = row._asdict()
+    if 'start_time' in data:
+        data['start_time'] = data['start_time'].isoformat()
+    return data
+
+
+def list_users(user_type):
+    fields = requested_fields(set(USER_COLUMNS) | {'num_upcoming_shows'},
+                              USER_FIELDS)
+    columns = [f for f in fields if f != 'num_upcoming_shows']
+
+    rows, next_cursor = page_users([Users.type == user_type],
+                                   limit=page_size(),
+                                   after=request.args.get('after', type=int),
+                                   fields=columns)
+    data = [as_json(row) for row in rows]
+
+    if 'num_upcoming_shows' in fields:
+        upcoming = count_upcoming_shows([user['id'] for user in data])
+        for user in data:
+            user['num_upcoming_shows'] = upcoming.get(user['id'], 0)
+
+    return jsonify(data=data, next_cursor=next_cursor)
+
+
+def list_shows(filters):
+    fields = requested_fields(set(SHOW_COLUMNS), SHOW_FIELDS)
+    try:
+        rows, next_cursor = page_shows(filters,
+                                       limit=page_size(),
+                                       after=request.args.get('after'),
+                                       fields=fields)
+    except ValueError:
+        abort(400, 'malformed cursor')
+
+    data = [as_json(row) for row in rows]
+    return jsonify(data=data, next_cursor=next_cursor)
+
+
+def profile(user_id, user_type):
+    data = cached_profile(user_id, user_type)
+    if data is None:
+        abort(404)
+
+    fields = requested_fields(set(data), data.keys())
+    return jsonify({field: data[field] for field in fields})
+
+
+def search(user_type):
+    term = request.args.get('q', '')
+    page = max(request.args.get('page', 1, type=int), 1)
+
+    found = search_users(term, user_type, page, page_size())
+    upcoming = count_upcoming_shows([id for id, _ in found['results']])
+
+    data = [{'id': id,
+             'name': name,
+             'num_upcoming_shows': upcoming.get(id, 0)}
+            for id, name in found['results']]
+
+    return jsonify(count=found['total'], data=data)
+
+
+@api.route('/users/latest')
+def latest_users():
+    fields = requested_fields(set(USER_COLUMNS),
+                              ('type', 'name', 'image_link'))
+    fields = ['id'] + [f for f in fields if f != 'id']
+
+    if set(fields) <= set(SIGN_UP_FIELDS):  # the home page feed has them
+        return jsonify(data=[{field: user[field] for field in fields}
+                             for user in sign_up_feed().get()])
+
+    rows = db.session.query(*[USER_COLUMNS[f] for f in fields])\
+        .order_by(db.desc(Users.id))\
+        .limit(current_app.config['LATEST_SIGN_UPS']).all()
+
+    return jsonify(data=[as_json(row) for row in rows])
+
+
+@api.route('/venues')
+def venues():
+    return list_users('Venue')
+
+
+@api.route('/artists')
+def artists():
+    return list_users('Artist')
+
+
+@api.route('/venues/near')
+def near_venues():
+    km = request.args.get('km', 30, type=float)
+    if not 0 < km <= 1000:
+        abort(400, 'km must be between 0 and 1000')
+
+    if 'city' in request.args:
+        place = gazetteer.geocode(request.args['city'],
+                                  request.args.get('state', ''))
+        if place is None:
+            abort(404, 'city not in the gazetteer')
+        latitude, longitude = place
+    else:
+        latitude = request.args.get('lat', type=float)
+        longitude = request.args.get('lon', type=float)
+        if latitude is None or longitude is None or \
+                not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            abort(400, 'lat and lon, or city and state, are required')
+
+    return jsonify(data=venues_near(latitude, longitude, km, page_size()))
+
+
+@api.route('/venues/within')
+def venues_within():
+    try:
+        south, west, north, east = \
+            map(float, request.args.get('bbox', '').split(','))
+    except ValueError:
+        abort(400, 'bbox must be south,west,north,east')
+    if not (-90 <= south <= north <= 90 and -180 <= west <= east <= 180):
+        abort(400, 'bbox must be south,west,north,east')
+
+    return jsonify(data=venues_in_box(south, west, north, east,
+                                      page_size()))
+
+
+@api.route('/venues/<int:user_id>')
+def show_venue(user_id):
+    return profile(user_id, 'Venue')
+
+
+@api.route('/artists/<int:user_id>')
+def show_artist(user_id):
+    return profile(user_id, 'Artist')
+
+
+@api.route('/shows')
+def shows():
+    return list_shows([Shows.start_time > todays_datetime()])
+
+
+@api.route('/calendar')
+def show_calendar():
+    if not request.args.get('city') or not request.args.get('state'):
+        abort(400, 'city and state are required')
+    try:
+        week = parse_week(request.args.get('week'), todays_datetime())
+        rows, next_cursor = calendar(request.args['city'],
+                                     request.args['state'],
+                                     week,
+                                     limit=page_size(),
+                                     after=request.args.get('after'))
+    except ValueError:
+        abort(400, 'malformed week or cursor')
+
+    data = [as_json(row) for row in rows]
+    for show in data:
+        show['week'] = week.strftime('%G-W%V')
+    return jsonify(data=data, next_cursor=next_cursor)
+
+
+def parse_show(show):
+    ''' A show of a schedule request, as the dict Shows takes '''
+    try:
+        start_time = datetime.fromisoformat(show['start_time'])
+        show = {'artist_id': int(show['artist_id']),
+                'venue_id': int(show['venue_id']),
+                'start_time': start_time}
+    except (KeyError, TypeError, ValueError):
+        return None
+    return show if start_time.tzinfo is None else None
+
+
+@api.route('/shows', methods=['POST'])
+def schedule():
+    '''
+        Books the shows of a JSON body:
+
+            {"shows": [{"artist_id": 1, "venue_id": 2,
+                        "start_time": "2030-06-01T20:00:00"}, ...]}
+
+        all or none. 201 with the number of shows booked, or 400 with the
+        errors of the shows that cannot be booked (an unknown artist or
+        venue, a double booking), by their index in the list.
+    '''
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get('shows'), list):
+        abort(400, 'the body must be {"shows": [...]}')
+    if len(body['shows']) > current_app.config['MAX_SHOWS_PER_SCHEDULE']:
+        abort(400, f'at most {current_app.config["MAX_SHOWS_PER_SCHEDULE"]} '
+                   f'shows per request')
+
+    shows = [parse_show(show) if isinstance(show, dict) else None
+             for show in body['shows']]
+    errors = [(index, 'artist_id, venue_id and start_time (ISO 8601, no '
+                      'offset) are required')
+              for index, show in enumerate(shows) if show is None]
+    if not errors:
+        try:
+            errors = schedule_shows(shows)
+            if not errors:
+                db.session.commit()
+        except IntegrityError:  # booked meanwhile, see scheduling.py
+            db.session.rollback()
+            return jsonify(error='some shows were booked meanwhile, '
+                                 'try again'), 409
+
+    if errors:
+        db.session.rollback()
+        return jsonify(errors=[{'index': index, 'error': error}
+                               for index, error in errors]), 400
+
+    invalidate_profiles({('Artist', show['artist_id']) for show in shows} |
+                        {('Venue', show['venue_id']) for show in shows})
+    return jsonify(scheduled=len(shows)), 201
+
+
+@api.route('/venues/search')
+def search_venues():
+    return search('Venue')
+
+
+@api.route('/artists/search')
+def search_artists():
+    return search('Artist')
+
+
+@api.route('/shows/search')
+def search_shows():
+    term = request.args.get('q', '')
+    return list_shows([db.or_(Artist_user.name.ilike(f'%{term}%'),
+                              Venue_user.name.ilike(f'%{term}%'))])
+
+
+@api.after_request
+def conditional_response(response):
+    ''' ETag of the body; a client sending it back in If-None-Match
+        gets an empty 304 when the data did not change '''
+    if response.status_code == 200:
+        response.add_etag()
+        response.make_conditional(request)
+    return response
+
+
+@api.errorhandler(400)
+@api.errorhandler(404)
+def api_error(error):
+    return jsonify(error=error.description), error.code
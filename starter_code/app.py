@@ -10,6 +10,7 @@
 
 
 import json
+from itertools import groupby
 import dateutil.parser
 import babel
 from flask import (
@@ -40,6 +41,55 @@ from models import (
     Artists,
     Shows
 )
+from queries import (
+    todays_datetime,
+    Artist_user,
+    Venue_user,
+    load_profile,
+    show_counterparts,
+    count_upcoming_shows,
+    genre_ids,
+    user_search_filters,
+    page_users,
+    page_shows
+)
+from search import init_user_index, search_users, user_index
+from enums import Genres_enum
+from importer import import_command
+from cache import init_profile_cache, cached_profile, invalidate_profiles
+from api import api
+from export import export, export_command
+from profiling import init_profiling
+from replicas import init_replicas, replica_reads
+from counters import recount, roll_command, check_command
+from sign_ups import init_sign_up_feed, sign_up_feed
+from geo import (
+    init_venue_grid,
+    locate,
+    venue_locations,
+    geocode_command
+)
+from scheduling import (
+    schedule_shows,
+    check_command as check_bookings_command
+)
+from show_calendar import (
+    init_calendar,
+    parse_week,
+    calendar,
+    calendar_changed,
+    refresh_command as refresh_calendar_command
+)
+from facets import init_facets, search_facets, facets_changed
+from bitmaps import (
+    init_bitmap_filters,
+    build_bitmap_filters,
+    bitmap_filters,
+    popcount,
+    index_user_filters,
+    unindex_user_filters,
+    users_by_ids
+)
 
 
 # ----------------------------------------------------------------------------#
@@ -50,8 +100,20 @@ app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
 db.init_app(app)
+init_replicas(app)
 csrf = CSRFProtect(app)
+csrf.exempt(api)  # JSON only, see api.py
 migrate = Migrate(app, db)
+init_profile_cache(app)
+init_sign_up_feed(app)
+init_calendar(app)
+init_facets(app)
+init_bitmap_filters(app)
+init_venue_grid(app)
+init_user_index(app)
+app.register_blueprint(api)
+app.register_blueprint(export)
+init_profiling(app)
 
 
 # ----------------------------------------------------------------------------#
@@ -59,11 +121,6 @@ migrate = Migrate(app, db)
 # ----------------------------------------------------------------------------#
 
 
-todays_datetime = datetime(datetime.today().year,
-                           datetime.today().month,
-                           datetime.today().day)
-
-
 def format_datetime(value, format='medium'):
     date = dateutil.parser.parse(value)
     if format == 'full':
@@ -80,20 +137,6 @@ app.jinja_env.filters['datetime'] = format_datetime
 # ----------------------------------------------------------------------------#
 
 
-def populate_genres_table():
-    genres = ['Alternative', 'Blues', 'Classical', 'Country', 'Electronic',
-              'Folk', 'Funk', 'HipHop', 'HeavyMetal', 'Instrumental',
-              'Jazz', 'MusicalTheatre', 'Pop', 'Punk', 'RB', 'Reggae',
-              'RocknRoll', 'Soul', 'Other']
-
-    for g in genres:
-        new_genre = Genres(name=g)
-        db.session.add(new_genre)
-
-    db.session.commit()
-    db.session.close()
-
-
 def roll_back_db_session():
     db.session.rollback()
     print("EXCEPTION DETECTED")
@@ -108,9 +151,6 @@ def add_data_from_form(form, templete):
      '/venues/create', methods=['POST']
      '/artists/create', methods=['POST']
      '''
-    if Genres.query.count() == 0:  # Initializes the Genres table
-        populate_genres_table()
-
     error = False
     form = form
 
@@ -144,17 +184,26 @@ def add_data_from_form(form, templete):
                          seeking_description=form.seeking_description.data)
 
         new_type.user = new_user
+        if type == 'Venue':
+            locate(new_type, new_user.city, new_user.state)
 
-        user_genres = []
         genres_submition = form.genres.data  # returns a list
-        for i in genres_submition:
-            genre = Genres.query.filter(Genres.name == i).one()
-            user_genres.append(User_genre(genre_id=genre.id))
-
-        new_user.genres = user_genres
+        new_user.genres = [User_genre(genre_id=id)
+                           for id in genre_ids.get_ids(genres_submition)]
 
         db.session.add(new_user)
         db.session.commit()
+        user_index.add(new_user.id, type, new_user.name)
+        sign_up_feed().add({'id': new_user.id,
+                            'type': type,
+                            'name': new_user.name,
+                            'image_link': new_user.image_link})
+        if type == 'Venue':
+            venue_locations.add(new_user.id,
+                                new_type.latitude, new_type.longitude)
+        facets_changed()
+        index_user_filters(new_user.id, type, new_user.state,
+                           new_user.city, genres_submition)
     except:
         error = roll_back_db_session()
     finally:
@@ -173,8 +222,18 @@ def add_data_from_form(form, templete):
 def delete_user(user_id):
     error = False
     try:
+        counterparts = show_counterparts(user_id)  # before the cascade
         Users.query.filter_by(id=user_id).delete()
+        recount([id for _, id in counterparts])  # their shows went too
+        calendar_changed([user_id])
         db.session.commit()
+        user_index.remove(int(user_id))
+        sign_up_feed().remove(int(user_id))
+        venue_locations.remove(int(user_id))
+        facets_changed()
+        unindex_user_filters(int(user_id))
+        invalidate_profiles({('Venue', user_id), ('Artist', user_id)} |
+                            counterparts)
     except:
         error = roll_back_db_session()
     finally:
@@ -198,13 +257,15 @@ def update_user(user_id,
 
     error = False
     try:
-        user_info.name = form.name.data,
-        user_info.city = form.city.data,
-        user_info.state = form.state.data,
-        user_info.phone = form.phone.data,
-        user_info.image_link = form.image_link.data,
-        user_info.facebook_link = form.facebook_link.data,
-        user_info.website = form.website.data,
+        moved = (user_info.city, user_info.state) != \
+            (form.city.data, form.state.data)
+        user_info.name = form.name.data
+        user_info.city = form.city.data
+        user_info.state = form.state.data
+        user_info.phone = form.phone.data
+        user_info.image_link = form.image_link.data
+        user_info.facebook_link = form.facebook_link.data
+        user_info.website = form.website.data
         user_info.seeking_description = form.seeking_description.data
 
         if form.is_seeking.data == "Yes":
@@ -212,21 +273,60 @@ def update_user(user_id,
         else:
             user_info.is_seeking = False
 
-        old_genres = User_genre.query.filter(User_genre.user_id == user_id)\
-                                     .delete()
-
-        user_genres = []
-        genres_submition = form.genres.data
-        for i in genres_submition:
-            genre = Genres.query.filter(Genres.name == i).one()
-            user_genres.append(User_genre(genre_id=genre.id))
-
-        user_info.genres = user_genres
-
         if user_info.type == 'Venue':
             user_additional_info.address = form.address.data
+            if moved:
+                locate(user_additional_info, form.city.data, form.state.data)
+
+        # checked before the genres query below autoflushes the changes
+        columns_changed = db.session.is_modified(user_info) or \
+            (user_additional_info is not None and
+             db.session.is_modified(user_additional_info))
+        user_type = user_info.type
+
+        ''' Only the genres that changed are written: one DELETE for the
+            removed ones and one multi-row INSERT for the added ones '''
+        old_genres = {row.genre_id for row in db.session
+                      .query(User_genre.genre_id)
+                      .filter(User_genre.user_id == user_id)}
+        new_genres = set(genre_ids.get_ids(form.genres.data))
+
+        removed_genres = old_genres - new_genres
+        added_genres = new_genres - old_genres
+
+        if removed_genres:
+            User_genre.query.filter(
+                User_genre.user_id == user_id,
+                User_genre.genre_id.in_(removed_genres)
+            ).delete(synchronize_session=False)
+
+        if added_genres:
+            db.session.execute(User_genre.__table__.insert(),
+                               [{'user_id': user_id, 'genre_id': genre_id}
+                                for genre_id in added_genres])
+
+        # an edit that changes nothing skips the commit
+        if columns_changed or removed_genres or added_genres:
+            stale = {(user_type, user_id)}
+            if columns_changed:  # name and image are on other profiles
+                stale |= show_counterparts(user_id)
+            if columns_changed or user_type == 'Artist':
+                calendar_changed([user_id])  # names, city, genres
 
-        db.session.commit()
+            db.session.commit()
+            user_index.add(user_id, user_type, form.name.data)
+            sign_up_feed().replace({'id': user_id,
+                                    'type': user_type,
+                                    'name': form.name.data,
+                                    'image_link': form.image_link.data})
+            if user_type == 'Venue' and moved:
+                venue_locations.add(user_id,
+                                    user_additional_info.latitude,
+                                    user_additional_info.longitude)
+            facets_changed()
+            index_user_filters(int(user_id), user_type, form.state.data,
+                               form.city.data, form.genres.data)
+            invalidate_profiles(stale)
     except:
         error = roll_back_db_session()
     finally:
@@ -240,67 +340,95 @@ def update_user(user_id,
         return redirect(url_for(url_str_for_return, user_id=user_id))
 
 
-def build_show_info(show, venue, artist):
+def build_show_info(show):
+    ''' 'show' is a row of queries.shows_query() '''
     show_info = {}
     show_info['venue_id'] = show.venue_id
-    show_info['venue_name'] = venue.name
+    show_info['venue_name'] = show.venue_name
     show_info['artist_id'] = show.artist_id
-    show_info['artist_name'] = artist.name
-    show_info['artist_image_link'] = artist.image_link
+    show_info['artist_name'] = show.artist_name
+    show_info['artist_image_link'] = show.artist_image_link
     show_info['start_time'] = str(show.start_time)
 
     return show_info
 
 
-def count_upcoming_shows(user_id):
-
-    ''' the model Shows hold both Artist and Venue, each with a relationship
-        to the Users class with a unique user id. Hance, the condition
-        (or_(Shows.artist_id == user_id, Shows.venue_id == user_id)
-        makes this function flexible to be used securely for both the Artist
-        route and Venue route without qurying unwanted records'''
-
-    num_of_shows = Shows.query.filter(
-        or_(Shows.artist_id == user_id, Shows.venue_id == user_id),
-        Shows.start_time > todays_datetime).count()
-
-    return num_of_shows
+def shows_page_size():
+    ''' Page size asked by the client, bounded by MAX_SHOWS_PER_PAGE '''
+    limit = request.values.get('limit', type=int)
+    if not limit or limit < 1:
+        limit = app.config['SHOWS_PER_PAGE']
+    return min(limit, app.config['MAX_SHOWS_PER_PAGE'])
 
 
-def query_genres(user_id):
-    user_genres = []
-    genres = db.session.query(User_genre, Genres)\
-        .outerjoin(Genres, User_genre.genre_id == Genres.id)\
-        .filter(User_genre.user_id == user_id)\
-        .all()
-
-    for genre in genres:
-        user_genres.append(genre[1].name)
-
-    return user_genres
+def get_shows_page(filters, count=False):
+    try:
+        return page_shows(filters,
+                          limit=shows_page_size(),
+                          after=request.values.get('after'),
+                          count=count)
+    except ValueError:
+        abort(400)  # malformed cursor
 
 
 def google(user_type, template):
 
     term = request.form['search_term']
+    page = max(request.form.get('page', 1, type=int), 1)
+    per_page = app.config['SEARCH_RESULTS_PER_PAGE']
 
-    query = Users.query.filter(Users.name.ilike(f'%{term}%'),
-                               Users.type == user_type)
+    found = search_users(term, user_type, page, per_page)
+    upcoming = count_upcoming_shows([id for id, _ in found['results']])
 
     data = []
-    for user in query.all():
+    for user_id, name in found['results']:
         dic = {}
-        dic['id'] = user.id
-        dic['name'] = user.name
-        dic["num_upcoming_shows"] = count_upcoming_shows(user.id)
+        dic['id'] = user_id
+        dic['name'] = name
+        dic["num_upcoming_shows"] = upcoming.get(user_id, 0)
         data.append(dic)
 
-    response = {"count": query.count(),
-                "data": data}
+    next_page = None
+    if page * per_page < found['total']:
+        next_page = page + 1
+
+    response = {"count": found['total'],
+                "data": data,
+                "next_page": next_page}
 
     return render_template(template, results=response, search_term=term)
 
 
+@app.before_first_request
+def warm_caches():
+    genre_ids.load()
+    sign_up_feed().load()
+    build_bitmap_filters()
+
+
+app.cli.add_command(import_command)
+app.cli.add_command(export_command)
+app.cli.add_command(roll_command)
+app.cli.add_command(check_command)
+app.cli.add_command(geocode_command)
+app.cli.add_command(refresh_calendar_command)
+app.cli.add_command(check_bookings_command)
+
+
+@app.cli.command('seed-genres')
+def seed_genres():
+    ''' Fills the Genres reference table from enums.Genres_enum.
+        Genres already in the table are kept, so it is safe to run again.
+        Run it once after 'flask db upgrade'. '''
+    existing = {g.name for g in Genres.query.all()}
+    missing = [g.name for g in Genres_enum if g.name not in existing]
+
+    db.session.add_all([Genres(name=name) for name in missing])
+    db.session.commit()
+    genre_ids.invalidate()
+    print(f'{len(missing)} genres added')
+
+
 # ----------------------------------------------------------------------------#
 # Controllers.
 # ----------------------------------------------------------------------------#
@@ -308,18 +436,7 @@ def google(user_type, template):
 
 @app.route('/')
 def index():
-    latests_sign_ups = Users.query.order_by(db.desc(Users.id)).limit(10).all()
-
-    data = []
-    for user in latests_sign_ups:
-        user_info = {}
-        user_info['id'] = user.id
-        user_info['type'] = user.type
-        user_info['name'] = user.name
-        user_info['image_link'] = user.image_link
-        data.append(user_info)
-
-    return render_template('pages/home.html', users=data)
+    return render_template('pages/home.html', users=sign_up_feed().get())
 
 
 # Venues
@@ -328,116 +445,45 @@ def index():
 
 @app.route('/venues')
 def venues():
-    places = Users.query.distinct(Users.city, Users.state)\
-        .filter(Users.type == 'Venue').all()
-    venues = Users.query.filter(Users.type == "Venue").all()
-    locals = []
+    venues = db.session.query(Users.id, Users.name, Users.city, Users.state,
+                              Venues.upcoming_shows_count)\
+        .join(Venues, Venues.user_id == Users.id)\
+        .order_by(Users.state, Users.city, Users.id).all()
 
-    for place in places:
+    # venues come sorted by area, so each area is built in a single pass
+    locals = []
+    for (state, city), area_venues in groupby(venues,
+                                              key=lambda v: (v.state, v.city)):
         locals.append({
-            "city": place.city,
-            "state": place.state,
+            "city": city,
+            "state": state,
             "venues": [{
                 "id": venue.id,
                 "name": venue.name,
-                "num_upcoming_shows": count_upcoming_shows(venue.id)
-            } for venue in venues if
-                venue.city == place.city and venue.state == place.state]
+                "num_upcoming_shows": venue.upcoming_shows_count
+            } for venue in area_venues]
         })
 
     return render_template('pages/venues.html', areas=locals)
 
 
 @app.route('/venues/search', methods=['POST'])
+@replica_reads
 def search_venues():
     return google(user_type='Venue', template='pages/search_venues.html')
 
 
 @app.route('/venues/<int:user_id>')
 def show_venue(user_id):
-    venue = Users.query.filter(Users.id == user_id).one()
+    data = cached_profile(user_id, 'Venue')
+    if data is None:
+        abort(404)
 
-    venue_additional_info = Venues.query.\
-        filter(Venues.user_id == user_id).one()
+    data = dict(data)  # the cached dict is shared, do not modify it
+    data["image_link"] = "https://images.unsplash.com/photo-"\
+                         "1485686531765-ba63b07845a7?ixlib=rb-1.2.1&ixid="\
+                         "eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=747&q=80"
 
-    genres_object = db.session\
-        .query(Genres.name)\
-        .join(User_genre, Genres.id == User_genre.genre_id)\
-        .filter(User_genre.user_id == user_id).all()
-
-    genres = []
-    for g in genres_object:
-        genre = g[0]
-        genres.append(genre)
-
-    '''
-        ** IMPORTANT NOTE **
-
-        Because of my models’ design, some of the necessary data
-        to build a show object in the view, like ‘image_link’ and
-        ‘venue/artist_name’ is not available in my Venue/Artist Class.
-        They are available in the Users class, which condenses all the
-        common information from both venues and artists.
-
-        Because of this, I had to creatively think of a solution
-        that would satisfy the rubric’s requirements by making a
-        join query like venue/artist.shows, while keeping my current
-        Models design. Otherwise, changing the models’ design to
-        satisfy a couple of lines of code would make me rewrite
-        the entire scrip.
-
-        Here, you can see that from the join query venues/artist.shows
-        I retract :
-            venue_id
-            artist_id
-            start_time
-
-        And I had to make an additional query to retract:
-            name
-            Image link
-
-        Please read my submission note for additional explanation.
-    '''
-
-    past_shows = []
-    upcoming_shows = []
-    for show in venue_additional_info.shows:  # JOIN QUERY
-        artist_info = Users.query\
-            .filter(Users.id == show.artist_id).one()
-
-        show_info = {
-            "artist_id": show.artist_id,  # from join query
-            "artist_name": artist_info.name,
-            "artist_image_link": artist_info.image_link
-            }
-        if show.start_time <= todays_datetime:  # from join query
-            show_info['start_time'] = str(show.start_time)
-            past_shows.append(show_info)
-        elif show.start_time > todays_datetime:  # from join query
-            show_info['start_time'] = str(show.start_time)
-            upcoming_shows.append(show_info)
-
-    data = {
-        "id": venue.id,
-        "name": venue.name,
-        "genres": genres,
-        "address": venue_additional_info.address,
-        "city": venue.city,
-        "state": venue.state,
-        "phone": venue.phone,
-        "website": venue.website,
-        "facebook_link": venue.facebook_link,
-        "is_seeking": venue.is_seeking,
-        "seeking_description": venue.seeking_description,
-        "image_link": "https://images.unsplash.com/photo-"
-                      "1485686531765-ba63b07845a7?ixlib=rb-1.2.1&ixid="
-                      "eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=747&q=80",
-        "past_shows": past_shows,
-        "upcoming_shows": upcoming_shows,
-        "past_shows_count": len(past_shows),
-        "upcoming_shows_count": len(upcoming_shows)
-      }
-    db.session.close()
     return render_template('pages/show_venue.html', venue=data)
 
 # Create Venue
@@ -480,94 +526,22 @@ def artists():
 
 
 @app.route('/artists/search', methods=['POST'])
+@replica_reads
 def search_artists():
     return google(user_type='Artist', template='pages/search_artists.html')
 
 
 @app.route('/artists/<int:user_id>')
 def show_artist(user_id):
-    artist = Users.query.filter(Users.id == user_id).one()
-
-    genres_object = db.session.query(Genres.name)\
-        .join(User_genre, Genres.id == User_genre.genre_id)\
-        .filter(User_genre.user_id == user_id).all()
+    data = cached_profile(user_id, 'Artist')
+    if data is None:
+        abort(404)
 
-    genres = []
-    for g in genres_object:
-        genre = g[0]
-        genres.append(genre)
+    data = dict(data)  # the cached dict is shared, do not modify it
+    data["image_link"] = "https://images.unsplash.com/photo-1485686531765"\
+                         "-ba63b07845a7?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOj"\
+                         "EyMDd9&auto=format&fit=crop&w=747&q=80"
 
-    '''
-    ** IMPORTANT NOTE **
-
-    Because of my models’ design, some of the necessary data
-    to build a show object in the view, like ‘image_link’ and
-    ‘venue/artist_name’ is not available in my Venue/Artist Class.
-    They are available in the Users class, which condenses all the
-    common information from both venues and artists.
-
-    Because of this, I had to creatively think of a solution
-    that would satisfy the rubric’s requirements by making a
-    join query like venue/artist.shows, while keeping my current
-    Models design. Otherwise, changing the models’ design to
-    satisfy a couple of lines of code would make me rewrite
-    the entire scrip.
-
-    Here, you can see that from the join query venues/artist.shows
-    I retract :
-        venue_id
-        artist_id
-        start_time
-
-    And I had to make an additional query to retract:
-        name
-        Image link
-
-    Please read my submission note for additional explanation.
-    '''
-
-    artist_shows = Artists.query\
-        .filter(Artists.user_id == user_id).one()
-
-    past_shows = []
-    upcoming_shows = []
-
-    for show in artist_shows.shows:  # Join query
-        venue_info = Users.query\
-            .filter(Users.id == show.venue_id).one()
-
-        show_info = {"venue_id": show.venue_id,  # From join query
-                     "venue_name": venue_info.name,
-                     "venue_image_link": venue_info.image_link
-                     }
-        if show.start_time <= todays_datetime:  # From join query
-            show_info['start_time'] = str(show.start_time)
-            past_shows.append(show_info)
-
-        elif show.start_time > todays_datetime:  # From join query
-            show_info['start_time'] = str(show.start_time)
-            upcoming_shows.append(show_info)
-
-    data = {
-        "id": artist.id,
-        "name": artist.name,
-        "genres": genres,
-        "city": artist.city,
-        "state": artist.state,
-        "phone": artist.phone,
-        "website": artist.website,
-        "facebook_link": artist.facebook_link,
-        "is_seeking": artist.is_seeking,
-        "seeking_description": artist.seeking_description,
-        "image_link": "https://images.unsplash.com/photo-1485686531765"
-                      "-ba63b07845a7?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOj"
-                      "EyMDd9&auto=format&fit=crop&w=747&q=80",
-        "past_shows": past_shows,
-        "upcoming_shows": upcoming_shows,
-        "past_shows_count": len(past_shows),
-        "upcoming_shows_count": len(upcoming_shows),
-    }
-    db.session.close()  # Not sure if I have to invoke this on queries
     return render_template('pages/show_artist.html', artist=data)
 
 
@@ -680,17 +654,34 @@ def delete_artist(user_id):
 
 @app.route('/shows')
 def shows():
-    shows = Shows.query.filter(Shows.start_time > todays_datetime)\
-            .order_by(Shows.venue_id).all()
+    upcoming = Shows.start_time > todays_datetime()
+    rows, next_cursor = get_shows_page([upcoming])
+    data = [build_show_info(show) for show in rows]
 
-    data = []
-    for show in shows:
-        venue = Users.query.filter(Users.id == show.venue_id).one()
-        artist = Users.query.filter(Users.id == show.artist_id).one()
-        show_info = build_show_info(show, venue, artist)
-        data.append(show_info)
+    return render_template('pages/shows.html', shows=data,
+                           next_cursor=next_cursor)
 
-    return render_template('pages/shows.html', shows=data)
+
+@app.route('/calendar')
+def show_calendar():
+    ''' What's on in a city in an ISO week, ?city=Austin&state=TX&week=
+        2031-W23 (this week by default). See show_calendar.py '''
+    city = request.args.get('city', '')
+    state = request.args.get('state', '')
+    try:
+        week = parse_week(request.args.get('week'), todays_datetime())
+        rows, next_cursor = calendar(city, state, week,
+                                     limit=shows_page_size(),
+                                     after=request.args.get('after'))
+    except ValueError:
+        abort(400)  # malformed week or cursor
+
+    data = [dict(build_show_info(show), genres=show.genres)
+            for show in rows]
+    return render_template('pages/calendar.html', shows=data,
+                           city=city, state=state,
+                           week=week.strftime('%G-W%V'),
+                           next_cursor=next_cursor)
 
 
 @app.route('/shows/create')
@@ -711,52 +702,54 @@ def create_show_submission():
 
     if form.validate_on_submit():
         try:
-            new_show = Shows(artist_id=form.artist_id.data,
-                             venue_id=form.venue_id.data,
-                             start_time=form.start_time.data)
-
-            db.session.add(new_show)
-            db.session.commit()
+            show = {'artist_id': int(form.artist_id.data),
+                    'venue_id': int(form.venue_id.data),
+                    'start_time': form.start_time.data}
+
+            errors = schedule_shows([show])
+            if errors:
+                error = '. '.join(message for _, message in errors)
+                db.session.rollback()
+            else:
+                db.session.commit()
+                invalidate_profiles({('Artist', form.artist_id.data),
+                                     ('Venue', form.venue_id.data)})
         except:
             error = roll_back_db_session()
         finally:
             db.session.close()
 
         if error:
+            if error is True:  # not one of the scheduling errors
+                error = "Somthing went wrong. Make sure the " \
+                        "Artist and Venue ID are correct."
             return render_template('forms/new_show.html',
                                    form=ShowForm(),
-                                   error="Somthing went wrong. Make sure the "
-                                         "Artist and Venue ID are correct.")
+                                   error=error)
         else:
             flash('Show was successfully listed!')
             return redirect(url_for('index'))
 
 
 @app.route('/shows/search', methods=["POST"])
+@replica_reads
 def search_shows():
     term = request.form["search_term"].lower()
-    shows = Shows.query.all()
+    filters = [or_(Artist_user.name.ilike(f'%{term}%'),
+                   Venue_user.name.ilike(f'%{term}%'))]
 
-    data = []
-    for show in shows:
-        venue = Users.query.filter(Users.id == show.venue_id).one()
-        artist = Users.query.filter(Users.id == show.artist_id).one()
-        if (term in artist.name.lower()) or (term in venue.name.lower()):
-            show_info = build_show_info(show, venue, artist)
-            data.append(show_info)
+    rows, next_cursor, count = get_shows_page(filters, count=True)
 
     result = {'term': term,
-              'data': data,
-              'count': len(data)}
+              'data': [build_show_info(show) for show in rows],
+              'count': count,
+              'next_cursor': next_cursor}
 
     return render_template('pages/search_shows.html', results=result)
 
 
-#  NOTE TO SELF: This route must be reworked to accomodate new
-#  data modeling. The advance_search is not a requirement of
-#  Udacity's project
-
 @app.route('/search_shows_advance', methods=['GET', 'POST'])
+@replica_reads
 def show_advance_search():
     form = ShowSeachForm()
     if request.method == 'GET':
@@ -787,10 +780,10 @@ def show_advance_search():
 
         # Filters input -------------------------------------------------------
 
-        artist_filter = Shows.artist_name.ilike(f'%{artist_submition}%')
-        venue_filter = Shows.venue_name.ilike(f'%{venue_submition}%')
-        city_filter = Shows.city.ilike(f'{city_submition}')
-        state_filter = Shows.state == state_submition
+        artist_filter = Artist_user.name.ilike(f'%{artist_submition}%')
+        venue_filter = Venue_user.name.ilike(f'%{venue_submition}%')
+        city_filter = Venue_user.city.ilike(f'{city_submition}')
+        state_filter = Venue_user.state == state_submition
         if start_time_submition:
             start_time_filter = Shows.start_time >= start_time_submition
 
@@ -806,33 +799,32 @@ def show_advance_search():
         if start_time_submition:
             filters.append(start_time_filter)
 
-        shows = Shows.query.filter(*filters).all()
+        rows, next_cursor, num_results = get_shows_page(filters, count=True)
 
-        data = []
-        for show in shows:
-            show_info = build_show_info(show)
-            data.append(show_info)
-
-        num_results = len(data)
+        data = [build_show_info(show) for show in rows]
 
         # TODO Ater submission: Try to implement an AJAX query in
         # the front end instead rendering the template
         return render_template('pages/search_shows_advance.html', form=form,
-                               shows=data, count=num_results)
+                               shows=data, count=num_results,
+                               next_cursor=next_cursor)
 
 
 @app.route('/advance_user_search', methods=['GET', 'POST'])
+@replica_reads
 def search_user():
     form = Advance_user_search_form()
     if request.method == 'GET':
         return render_template('pages/search_users_by_filters.html', form=form)
+    if not form.validate_on_submit():
+        return render_template('pages/search_users_by_filters.html',
+                               form=form,
+                               error=form.errors), 400
 
-    if request.method == 'POST':
-
-        city_submition = form.city.data
-        state_submition = form.state.data
-        type_submition = form.type.data
-        genres_submition = form.genres.data
+    city_submition = form.city.data
+    state_submition = form.state.data
+    type_submition = form.type.data
+    genres_submition = form.genres.data  # returns a list
 
     '''
         The form fields return a 'str type' even if the field
@@ -847,61 +839,34 @@ def search_user():
     if type_submition == 'type' or type_submition == 'both':
         type_submition = None
 
-    if genres_submition == '[]':
-        genres_submition = None
-    else:
-        genres_selection = []
-        for genre in genres_submition:
-            genres_selection.append(Genres.name == genre)
-
     # Filters input -------------------------------------------------------
 
-    city_filter = Users.city.ilike(f'{city_submition}')
-    state_filter = Users.state == state_submition
-    type_filter = Users.type == type_submition
-    genres_filter = or_(*genres_selection)
-
-    filters = []
-    if city_submition:
-        filters.append(city_filter)
-    if state_submition:
-        filters.append(state_filter)
-    if type_submition:
-        filters.append(type_filter)
-    if genres_submition:
-        filters.append(genres_filter)
-
-    query = db.session.query(Users.id,
-                             Users.name,
-                             Users.type,
-                             Users.image_link,
-                             db.func.count(User_genre.user_id))\
-        .outerjoin(User_genre, Users.id == User_genre.user_id)\
-        .outerjoin(Genres, User_genre.genre_id == Genres.id)\
-        .filter(*filters).group_by(Users.id).all()
-
-    ''' The following for loop furthers filters the query.
-        If the user selects genres as filter, we display only the
-        artists/venues that meet exactly all genres the user selected '''
-
-    results = []
-    for data in query:
-        genres_count = data[4]
-
-        user_info = {}
-        user_info['id'] = data[0]
-        user_info['name'] = data[1]
-        user_info['type'] = data[2]
-        user_info['image_link'] = data[3]
-
-        if genres_submition:
-            if genres_count == len(genres_selection):
-                results.append(user_info)
-        else:  # when user does not pick any genre as a filter
-            results.append(user_info)
-
-    web_data = {'results': results,
-                'results_count': len(results)}
+    search = {'city': city_submition,
+              'state': state_submition,
+              'user_type': type_submition,
+              'genres': sorted(genres_submition or []),
+              'match_all': form.genres_match.data != 'any'}
+    after = request.form.get('after', type=int)
+    limit = app.config['SEARCH_RESULTS_PER_PAGE']
+
+    index = bitmap_filters()
+    matched = index.match(**search) if index is not None else None
+    if matched is not None:  # only the rows of the page are read
+        ids, next_cursor = index.page(matched, limit, after)
+        results = users_by_ids(ids)
+        results_count = popcount(matched)
+        facets = index.facets(matched)
+    else:
+        # counted with the page: the facets may be FACETS_MAX_AGE old
+        results, next_cursor, results_count = page_users(
+            user_search_filters(**search), limit=limit, after=after,
+            count=True)
+        facets = search_facets(search)
+
+    web_data = {'results': [row._asdict() for row in results],
+                'results_count': results_count,
+                'facets': facets,
+                'next_cursor': next_cursor}
 
     return render_template('pages/search_users_by_filters.html',
                            form=form,
@@ -0,0 +1,113 @@
+# ----------------------------------------------------------------------------#
+# Async queries.
+# ----------------------------------------------------------------------------#
+#  fetch() runs independent statements of a read path at the same time,
+#  on an asyncio engine (asyncpg), when ASYNC_QUERIES is set in
+#  config.py. Otherwise, and for a single statement, they run one after
+#  the other on db.session, as before.
+#
+#  Flask 2.0 is a WSGI framework: its 'async def' views start a new event
+#  loop for every request, and an asyncpg pool can not outlive the loop
+#  its connections were opened in. So each worker process runs one event
+#  loop in a background thread; the request threads hand their queries
+#  to it and wait for the results. The loop multiplexes the database I/O
+#  of all the requests of the worker over one async pool.
+#
+#  The queries read committed data only, from the database the session
+#  would read from (a replica in a read-only request, see replicas.py).
+#
+#  Async mode is refused where it would read the wrong data or fail:
+#
+#    - on an in-memory SQLite database: an aiosqlite connection opens a
+#      new, empty one
+#    - with PGBOUNCER: the asyncpg adapter of SQLAlchemy 1.4 runs every
+#      statement as a named prepared statement, which PgBouncer in
+#      transaction pooling mode can not keep
+# ----------------------------------------------------------------------------#
+
+import asyncio
+import threading
+from flask import current_app
+from sqlalchemy.ext.asyncio import create_async_engine
+from config import PGBOUNCER, engine_options
+from models import db
+
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg',
+                 'sqlite': 'sqlite+aiosqlite'}
+
+
+class EventLoopThread:
+    ''' An event loop running in a daemon thread, one per process '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loop = None
+
+    def run(self, coroutine):
+        ''' Runs 'coroutine' on the loop and waits for its result '''
+        with self.lock:
+            if self.loop is None:  # started lazily, after a fork
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever,
+                                 name='async-queries',
+                                 daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)\
+            .result()
+
+
+event_loop = EventLoopThread()
+
+
+class AsyncEngines:
+    ''' The async engine of each (sync) engine of the app '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.engines = {}
+
+    def get(self, engine):
+        with self.lock:
+            if engine not in self.engines:
+                check_async_mode(engine.url)
+                url = engine.url.set(
+                    drivername=ASYNC_DRIVERS[engine.url.get_backend_name()])
+                self.engines[engine] = create_async_engine(
+                    url, **engine_options(str(url)))
+            return self.engines[engine]
+
+
+async_engines = AsyncEngines()
+
+
+def check_async_mode(url):
+    ''' Raises RuntimeError if async mode can not run on 'url' '''
+    if url.get_backend_name() == 'sqlite' and \
+            url.database in (None, '', ':memory:'):
+        raise RuntimeError('ASYNC_QUERIES needs a SQLite file, an async '
+                           'connection can not share an in-memory database')
+    if url.get_backend_name() == 'postgresql' and PGBOUNCER:
+        raise RuntimeError('ASYNC_QUERIES can not run through PgBouncer '
+                           '(PGBOUNCER=1): asyncpg prepares every statement')
+
+
+async def fetch_all(engine, statement, params):
+    async with engine.connect() as connection:  # one connection each
+        result = await connection.execute(statement, params)
+        return result.all()
+
+
+async def fetch_concurrently(engine, statements, params):
+    return await asyncio.gather(*[fetch_all(engine, statement, params)
+                                  for statement in statements])
+
+
+def fetch(*statements, params=None):
+    ''' Returns the rows of each statement (one list per statement),
+        all executed with the same bind 'params' '''
+    params = params or {}
+    if len(statements) < 2 or not current_app.config.get('ASYNC_QUERIES'):
+        return [db.session.execute(statement, params).all()
+                for statement in statements]
+
+    engine = async_engines.get(db.session.get_bind())
+    return event_loop.run(fetch_concurrently(engine, statements, params))
@@ -0,0 +1,42 @@
+# ----------------------------------------------------------------------------#
+# Benchmarks.
+# ----------------------------------------------------------------------------#
+#  Run from the starter_code directory. URL is a PostgreSQL database
+#  (postgresql://localhost/fyyur_bench) shared by the commands below;
+#  an in-memory SQLite database (sqlite://) only lives in one process,
+#  so the driver then generates its own data with --generate.
+#
+#    python -m benchmarks.generate --shows 10000 --database-url URL
+#        fills the database with deterministic synthetic data
+#
+#    python -m benchmarks.driver --database-url URL
+#        hits every route with the Flask test client and reports
+#        p50/p99 latency and queries per request for each, and the peak
+#        RSS of the process. It compares the results with
+#        benchmarks/baseline.json and exits with 1 on a regression;
+#        --update-baseline writes the new results there instead. The
+#        baseline was made with
+#
+#            python -m benchmarks.driver --database-url sqlite:// \
+#                --generate 10000 --update-baseline
+#
+#    python -m benchmarks.async_mode --database-url URL --threads 16
+#        throughput and latency of the profile pages and the shows
+#        search from concurrent clients, in sync and in async mode
+#        (ASYNC_QUERIES, needs asyncpg)
+#
+#    python -m benchmarks.compile_cache --database-url URL
+#        Python time per profile load with ORM Query objects built per
+#        call, with the module level statements, and with those
+#        statements recompiled on every call
+#
+#    python -m benchmarks.home_page --database-url URL
+#        latency and queries of the home page on the first request after
+#        startup (cold), from the sign up feed (warm) and when the feed
+#        expired (reload)
+#
+#    python -m benchmarks.bitmap_filters --users 1000000
+#        memory per million users and filter latency of the bitmap
+#        filters (BITMAP_FILTERS); with --database-url URL, also the
+#        latency of the same searches in SQL
+# ----------------------------------------------------------------------------#
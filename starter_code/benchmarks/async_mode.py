@@ -0,0 +1,92 @@
+'''
+    Sync vs async mode (ASYNC_QUERIES) benchmark.
+
+    Hits the read paths async mode changes (the profile pages and the
+    shows search) from --threads concurrent clients, once per mode, and
+    reports the throughput and p50/p99 latency of each. The profile
+    cache is disabled so every profile request reaches the database.
+
+    Run it against PostgreSQL, filled by benchmarks.generate: async mode
+    pays off when the queries wait on the network, not on a local file.
+'''
+
+import argparse
+import threading
+import time
+from benchmarks.driver import percentile
+
+
+def target_urls(app, count):
+    from models import db, Users
+    with app.app_context():
+        ids = {t: [row[0] for row in db.session.query(Users.id)
+                   .filter(Users.type == t).order_by(Users.id).limit(count)]
+               for t in ('Venue', 'Artist')}
+    urls = [('GET', f'/venues/{id}', None) for id in ids['Venue']] + \
+        [('GET', f'/artists/{id}', None) for id in ids['Artist']]
+    search = ('POST', '/shows/search', {'search_term': 'blue'})
+    return [request for pair in zip(urls, [search] * len(urls))
+            for request in pair]
+
+
+def run_clients(app, urls, threads, requests):
+    ''' Returns (requests per second, per request timings) '''
+    timings = []
+    lock = threading.Lock()
+
+    def client(offset):
+        client = app.test_client()
+        mine = []
+        for i in range(requests):
+            method, url, data = urls[(offset + i) % len(urls)]
+            started = time.perf_counter()
+            client.open(url, method=method, data=data)
+            mine.append(time.perf_counter() - started)
+        with lock:
+            timings.extend(mine)
+
+    workers = [threading.Thread(target=client, args=(i * requests,))
+               for i in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return len(timings) / (time.perf_counter() - started), timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--database-url',
+                        help='defaults to SQLALCHEMY_DATABASE_URI')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=50,
+                        help='requests per thread')
+    args = parser.parse_args()
+
+    from app import app
+    from cache import LRUCache
+    from config import engine_options
+    if args.database_url:
+        app.config['SQLALCHEMY_DATABASE_URI'] = args.database_url
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = \
+            engine_options(args.database_url)
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.extensions['profile_cache'] = LRUCache(0, 0)
+
+    urls = target_urls(app, 100)
+    app.test_client().get('/')  # first request hooks run here
+
+    print(f'{"mode":<8}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}')
+    for mode in ('sync', 'async'):
+        app.config['ASYNC_QUERIES'] = mode == 'async'
+        run_clients(app, urls, args.threads, 5)  # warms the pools up
+        throughput, timings = run_clients(app, urls, args.threads,
+                                          args.requests)
+        print(f'{mode:<8}{throughput:>10.1f}'
+              f'{percentile(timings, 0.50) * 1000:>10.2f}'
+              f'{percentile(timings, 0.99) * 1000:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+'''
+    Bitmap filters (BITMAP_FILTERS) benchmark.
+
+    Fills a bitmaps.BitmapIndex with --users synthetic users, no
+    database involved, and reports its memory per million users and the
+    latency of --searches random advanced searches:
+
+        match     the bitmap of the matching users
+        page      the ids of the first page of results
+        facets    the counts per genre, state and type
+
+    With --database-url (filled by benchmarks.generate), it also times
+    the same kind of searches on that database, answered by the index
+    built from it and by the SQL queries of the search (page and facets).
+'''
+
+import argparse
+import random
+import time
+from benchmarks.driver import percentile
+from benchmarks.generate import CITIES
+
+
+def random_search(rnd, states, genres):
+    ''' Arguments of queries.user_search_filters, like the search form
+        sends them: most fields left empty '''
+    return {'city': rnd.choice([None] * 3 + [c for c, _ in CITIES[:3]]),
+            'state': rnd.choice([None] + states),
+            'user_type': rnd.choice([None, 'Artist', 'Venue']),
+            'genres': sorted(rnd.sample(genres, rnd.randint(0, 3))),
+            'match_all': rnd.random() < 0.5}
+
+
+def timed(function, searches):
+    ''' Per search timings of function(search) '''
+    timings = []
+    for search in searches:
+        started = time.perf_counter()
+        function(search)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def report(name, timings):
+    print(f'{name:<16}{percentile(timings, 0.50) * 1000:>10.3f}'
+          f'{percentile(timings, 0.99) * 1000:>10.3f}')
+
+
+def synthetic(users, searches, rnd):
+    from enums import Genres_enum, States_enum
+    from bitmaps import BitmapIndex
+
+    states = [s.name for s in States_enum if s.name != 'State']
+    genres = [g.name for g in Genres_enum]
+    index = BitmapIndex()
+
+    rows = []
+    for user_id in range(1, users + 1):
+        city, state = rnd.choice(CITIES)
+        rows.append((user_id,
+                     'Venue' if rnd.random() < 0.25 else 'Artist',
+                     rnd.choice(states) if rnd.random() < 0.5 else state,
+                     city,
+                     rnd.sample(genres, rnd.randint(1, 4))))
+    started = time.perf_counter()
+    index.load(rows)
+    built = time.perf_counter() - started
+
+    print(f'{users} users: {index.memory() / users * 1e6 / 2**20:.1f} MiB '
+          f'per million users, built in {built:.1f} s')
+
+    searches = [random_search(rnd, states, genres) for _ in range(searches)]
+    print(f'{"":<16}{"p50 ms":>10}{"p99 ms":>10}')
+    report('match', timed(lambda s: index.match(**s), searches))
+    report('page', timed(lambda s: index.page(index.match(**s), 20),
+                         searches))
+    report('facets', timed(lambda s: index.facets(index.match(**s)),
+                           searches))
+
+
+def on_database(database_url, searches, rnd):
+    from app import app
+    from config import engine_options
+    from enums import Genres_enum, States_enum
+    from models import db
+    from bitmaps import BitmapIndex, users_by_ids
+    from facets import count_facets
+    from queries import page_users, user_search_filters
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(database_url)
+
+    states = [s.name for s in States_enum if s.name != 'State']
+    genres = [g.name for g in Genres_enum]
+    searches = [random_search(rnd, states, genres) for _ in range(searches)]
+
+    def with_bitmaps(search):
+        matched = index.match(**search)
+        ids, _ = index.page(matched, 20)
+        users_by_ids(ids)
+        index.facets(matched)
+
+    def with_sql(search):
+        page_users(user_search_filters(**search), limit=20)
+        count_facets(search)
+
+    with app.app_context():
+        index = BitmapIndex()
+        index.build()
+        print(f'\n{database_url}: {len(index.users)} users')
+        print(f'{"":<16}{"p50 ms":>10}{"p99 ms":>10}')
+        report('bitmaps', timed(with_bitmaps, searches))
+        report('sql', timed(with_sql, searches))
+        db.session.remove()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--searches', type=int, default=500)
+    parser.add_argument('--database-url',
+                        help='also compare with SQL on this database')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    synthetic(args.users, args.searches, rnd)
+    if args.database_url:
+        on_database(args.database_url, args.searches, rnd)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+'''
+    Statement construction and compilation micro-benchmark.
+
+    Loads the same profile --repeat times, three ways, and reports the
+    time per load:
+
+        query         the 3 ORM Query objects built on every call, as
+                      load_profile did before queries.PROFILE_USER & co.
+        statement     the module level statements of queries.py
+        no cache      the same statements with the compiled cache off,
+                      so each execution compiles them again
+
+    The database work is the same in the three; the differences are the
+    Python time spent building and compiling the statements.
+'''
+
+import argparse
+import time
+from models import db, User_genre, Users, Genres, Venues, Shows
+from queries import (
+    PROFILE_USER,
+    USER_GENRES,
+    USER_SHOWS,
+    USER_COLUMNS,
+    PROFILE_FIELDS
+)
+
+
+def with_queries(user_id):
+    ''' The queries load_profile used to build for a venue '''
+    db.session.query(*[USER_COLUMNS[f] for f in PROFILE_FIELDS],
+                     Venues.address)\
+        .outerjoin(Venues, Venues.user_id == Users.id)\
+        .filter(Users.id == user_id, Users.type == 'Venue').all()
+    db.session.query(Genres.name)\
+        .join(User_genre, Genres.id == User_genre.genre_id)\
+        .filter(User_genre.user_id == user_id)\
+        .order_by(Genres.name).all()
+    db.session.query(Shows.start_time, Users.id, Users.name,
+                     Users.image_link)\
+        .join(Users, Users.id == Shows.artist_id)\
+        .filter(Shows.venue_id == user_id)\
+        .order_by(Shows.start_time, Shows.id).all()
+
+
+def with_statements(user_id, execution_options=None):
+    params = {'user_id': user_id, 'user_type': 'Venue'}
+    for statement in (PROFILE_USER, USER_GENRES, USER_SHOWS['Venue']):
+        db.session.execute(statement, params,
+                           execution_options=execution_options or {}).all()
+
+
+def time_per_call(function, user_id, repeat):
+    function(user_id)  # compiles and caches
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function(user_id)
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--database-url',
+                        help='defaults to SQLALCHEMY_DATABASE_URI')
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    from app import app
+    from config import engine_options
+    if args.database_url:
+        app.config['SQLALCHEMY_DATABASE_URI'] = args.database_url
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = \
+            engine_options(args.database_url)
+
+    with app.app_context():
+        user_id = db.session.query(db.func.min(Users.id))\
+            .filter(Users.type == 'Venue').scalar()
+        if user_id is None:
+            raise SystemExit('no venue, run benchmarks.generate first')
+
+        runs = [('query', with_queries),
+                ('statement', with_statements),
+                ('no cache', lambda user_id: with_statements(
+                    user_id, {'compiled_cache': None}))]
+        timings = {name: time_per_call(function, user_id, args.repeat)
+                   for name, function in runs}
+
+    print(f'{"":<12}{"us/profile":>12}{"vs query":>10}')
+    for name, seconds in timings.items():
+        print(f'{name:<12}{seconds * 1e6:>12.0f}'
+              f'{seconds / timings["query"]:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
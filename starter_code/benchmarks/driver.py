@@ -0,0 +1,299 @@
+'''
+    Benchmark driver.
+
+    Hits every route of the app (pages, searches, JSON API and the
+    writes: create, edit and delete) with the Flask test client, against a database filled by
+    benchmarks.generate, and reports for each route the p50/p99 latency
+    and the queries per request, plus the peak RSS of the process.
+
+    The results are compared with a baseline file: a route regresses
+    when it runs more queries per request than the baseline, or when its
+    p99 grows by more than --tolerance (50% by default, latency is
+    noisy). On a regression the driver exits with status 1.
+
+    --generate SHOWS fills the database with benchmarks.generate first,
+    in the same process: an in-memory SQLite database (sqlite://) is
+    only seen by the process that created it. baseline.json comes from
+
+        python -m benchmarks.driver --database-url sqlite:// \
+            --generate 10000 --update-baseline
+'''
+
+import argparse
+import json
+import resource
+import sys
+import time
+from datetime import timedelta
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+BASELINE = 'benchmarks/baseline.json'
+
+
+def schedule_body(request, ids, first_slot):
+    ''' The JSON body of a POST /api/v1/shows: SCHEDULE_SIZE shows,
+        each in its own slot after the shows already in the database,
+        so no request double books '''
+    from models import SHOW_LENGTH
+    shows = []
+    for n in range(request * SCHEDULE_SIZE, (request + 1) * SCHEDULE_SIZE):
+        start_time = first_slot + n * SHOW_LENGTH
+        shows.append({'artist_id': ids['Artist'][n % len(ids['Artist'])],
+                      'venue_id': ids['Venue'][n % len(ids['Venue'])],
+                      'start_time': start_time.isoformat()})
+    return {'shows': shows}
+
+
+SCHEDULE_SIZE = 10
+
+
+def user_form(request, user_type):
+    ''' The form of a /venues or /artists create or edit that passes
+        validation; the name changes on every request, so an edit
+        always writes '''
+    form = {'name': f'Bench {user_type} {request}',
+            'city': 'Austin', 'state': 'TX', 'phone': '512-555-0100',
+            'image_link': '', 'genres': ['Jazz', 'Blues'],
+            'facebook_link': 'https://www.facebook.com/bench',
+            'website': 'https://bench.example.com',
+            'is_seeking': 'No', 'seeking_description': ''}
+    if user_type == 'Venue':
+        form['address'] = f'{request} Congress Ave'
+    return form
+
+
+def venue_form(request, ids, first_slot):
+    return user_form(request, 'Venue')
+
+
+def artist_form(request, ids, first_slot):
+    return user_form(request, 'Artist')
+
+
+def show_form(request, ids, first_slot):
+    ''' The form of a /shows/create, one show per slot as schedule_body '''
+    from models import SHOW_LENGTH
+    start_time = first_slot + request * SHOW_LENGTH
+    return {'artist_id': ids['Artist'][request % len(ids['Artist'])],
+            'venue_id': ids['Venue'][request % len(ids['Venue'])],
+            'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def routes():
+    ''' (label, method, url, form data) of every route. '{venue}' and
+        '{artist}' are replaced by ids that rotate on each request, so
+        the profile cache is not always hit; '{new_venue}' and
+        '{new_artist}' by the newest ones, those the create routes
+        added. A callable form data is called with (request number, ids,
+        first free slot), its result is sent as a JSON body to the API
+        and as a form to the pages. The writes come last, the deletes
+        at the very end. '''
+    search = {'search_term': 'blue'}
+    # a week of the generated shows (2020 to 2029)
+    calendar = 'city=Austin&state=TX&week=2024-W10'
+    return [
+        ('GET /', 'GET', '/', None),
+        ('GET /venues', 'GET', '/venues', None),
+        ('GET /artists', 'GET', '/artists', None),
+        ('GET /shows', 'GET', '/shows', None),
+        ('GET /venues/<id>', 'GET', '/venues/{venue}', None),
+        ('GET /artists/<id>', 'GET', '/artists/{artist}', None),
+        ('GET /venues/<id>/edit', 'GET', '/venues/{venue}/edit', None),
+        ('GET /artists/<id>/edit', 'GET', '/artists/{artist}/edit', None),
+        ('GET /venues/create', 'GET', '/venues/create', None),
+        ('GET /artists/create', 'GET', '/artists/create', None),
+        ('GET /shows/create', 'GET', '/shows/create', None),
+        ('POST /venues/search', 'POST', '/venues/search', search),
+        ('POST /artists/search', 'POST', '/artists/search', search),
+        ('POST /shows/search', 'POST', '/shows/search', search),
+        ('POST /search_shows_advance', 'POST', '/search_shows_advance',
+         {'artist_name': 'blue', 'venue_name': '', 'city': '',
+          'state': 'State', 'start_time': ''}),
+        ('POST /advance_user_search', 'POST', '/advance_user_search',
+         {'type': 'Artist', 'city': '', 'state': 'State',
+          'genres': ['Jazz', 'Blues'], 'genres_match': 'any'}),
+        ('GET /api/v1/users/latest', 'GET', '/api/v1/users/latest', None),
+        ('GET /api/v1/venues', 'GET', '/api/v1/venues', None),
+        ('GET /api/v1/artists', 'GET', '/api/v1/artists', None),
+        ('GET /api/v1/shows', 'GET', '/api/v1/shows', None),
+        ('GET /api/v1/venues/<id>', 'GET', '/api/v1/venues/{venue}', None),
+        ('GET /api/v1/artists/<id>', 'GET', '/api/v1/artists/{artist}',
+         None),
+        ('GET /api/v1/venues/search', 'GET', '/api/v1/venues/search?q=blue',
+         None),
+        ('GET /api/v1/shows/search', 'GET', '/api/v1/shows/search?q=blue',
+         None),
+        ('GET /calendar', 'GET', f'/calendar?{calendar}', None),
+        ('GET /api/v1/calendar', 'GET', f'/api/v1/calendar?{calendar}',
+         None),
+        ('GET /api/v1/venues/near', 'GET',
+         '/api/v1/venues/near?lat=30.27&lon=-97.74&km=300', None),
+        ('GET /api/v1/venues/within', 'GET',
+         '/api/v1/venues/within?bbox=25,-105,40,-90', None),
+        ('GET /export/shows.csv', 'GET', '/export/shows.csv', None),
+        ('GET /export/users.ndjson', 'GET', '/export/users.ndjson', None),
+        ('POST /api/v1/shows', 'POST', '/api/v1/shows', schedule_body),
+        ('POST /venues/create', 'POST', '/venues/create', venue_form),
+        ('POST /artists/create', 'POST', '/artists/create', artist_form),
+        ('POST /shows/create', 'POST', '/shows/create', show_form),
+        ('POST /venues/<id>/edit', 'POST', '/venues/{venue}/edit',
+         venue_form),
+        ('POST /artists/<id>/edit', 'POST', '/artists/{artist}/edit',
+         artist_form),
+        ('POST /venues/<id>/delete', 'POST', '/venues/{new_venue}/delete',
+         None),
+        ('POST /artists/<id>/delete', 'POST',
+         '/artists/{new_artist}/delete', None),
+    ]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def targets(app):
+    ''' The ids the routes use, oldest and newest 100 of each type, and
+        the first slot after the last show. Read again before each
+        route, as the writes before it add users and shows. '''
+    from models import db, Users, Shows, SHOW_LENGTH
+
+    with app.app_context():
+        ids = {}
+        for t in ('Venue', 'Artist'):
+            query = db.session.query(Users.id).filter(Users.type == t)
+            ids[t] = [row[0] for row in query.order_by(Users.id).limit(100)]
+            ids['new ' + t] = [row[0] for row in query
+                               .order_by(Users.id.desc()).limit(100)]
+        last_show = db.session.query(db.func.max(Shows.start_time)).scalar()
+        first_slot = last_show.replace(minute=0, second=0, microsecond=0) \
+            + timedelta(hours=1) + SHOW_LENGTH
+        db.session.remove()
+    return ids, first_slot
+
+
+def run(app, requests):
+    ''' Returns {label: {"p50_ms", "p99_ms", "queries"}} '''
+    queries = [0]
+
+    def count_query(*args):
+        queries[0] += 1
+
+    event.listen(Engine, 'before_cursor_execute', count_query)
+
+    client = app.test_client()
+    client.get('/')  # first request hooks (cache warm up) run here
+
+    results = {}
+    for label, method, url, data in routes():
+        ids, first_slot = targets(app)
+        timings = []
+        queries[0] = 0
+        for i in range(requests):
+            target = url.format(
+                venue=ids['Venue'][i % len(ids['Venue'])],
+                artist=ids['Artist'][i % len(ids['Artist'])],
+                new_venue=ids['new Venue'][i % len(ids['new Venue'])],
+                new_artist=ids['new Artist'][i % len(ids['new Artist'])])
+            if not callable(data):
+                body = {'data': data}
+            elif url.startswith('/api/'):
+                body = {'json': data(i, ids, first_slot)}
+            else:
+                body = {'data': data(i, ids, first_slot)}
+            started = time.perf_counter()
+            response = client.open(target, method=method, **body)
+            response.get_data()  # streamed responses are read here
+            timings.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                sys.exit(f'{label}: HTTP {response.status_code}')
+            if 'data' in body and callable(data) and \
+                    response.status_code != 302:
+                # a form that does not validate is rendered again
+                sys.exit(f'{label}: the form was not accepted')
+
+        results[label] = {
+            'p50_ms': round(percentile(timings, 0.50) * 1000, 2),
+            'p99_ms': round(percentile(timings, 0.99) * 1000, 2),
+            'queries': round(queries[0] / requests, 2)
+        }
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    ''' Returns the list of regressions, as messages '''
+    regressions = []
+    for label, result in results.items():
+        base = baseline.get(label)
+        if base is None:
+            continue
+        if result['queries'] > base['queries']:
+            regressions.append(f'{label}: {result["queries"]} queries per '
+                               f'request (baseline {base["queries"]})')
+        if result['p99_ms'] > base['p99_ms'] * (1 + tolerance) + 1:
+            regressions.append(f'{label}: p99 {result["p99_ms"]}ms '
+                               f'(baseline {base["p99_ms"]}ms)')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--database-url',
+                        help='defaults to SQLALCHEMY_DATABASE_URI')
+    parser.add_argument('--requests', type=int, default=50,
+                        help='requests per route')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.5)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--generate', type=int, metavar='SHOWS',
+                        help='first fill the database with this many '
+                             'shows (benchmarks.generate)')
+    args = parser.parse_args()
+
+    from app import app
+    from config import engine_options
+    if args.database_url:
+        app.config['SQLALCHEMY_DATABASE_URI'] = args.database_url
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = \
+            engine_options(args.database_url)
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    if args.generate:
+        from benchmarks.generate import generate
+        with app.app_context():
+            generate(args.generate)
+
+    results = run(app, args.requests)
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(f'{"route":<32}{"p50 ms":>10}{"p99 ms":>10}{"queries":>10}')
+    for label, result in results.items():
+        print(f'{label:<32}{result["p50_ms"]:>10}{result["p99_ms"]:>10}'
+              f'{result["queries"]:>10}')
+    print(f'peak RSS: {peak_rss_mb:.1f} MB')
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=2)
+            file.write('\n')
+        print(f'baseline written to {args.baseline}')
+        return
+
+    try:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    except FileNotFoundError:
+        print(f'no baseline at {args.baseline}, nothing to compare')
+        return
+
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
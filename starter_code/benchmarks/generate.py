@@ -0,0 +1,163 @@
+'''
+    Deterministic synthetic data for the benchmarks.
+
+    On an empty database, the same --seed and --shows always produce
+    the same rows. The number of users follows the number of shows (one
+    user per 10 shows, a quarter of them venues), so --shows alone sets
+    the scale, from 1k to 1M shows.
+'''
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from enums import Genres_enum
+from models import (
+    db,
+    User_genre,
+    Users,
+    Genres,
+    Venues,
+    Artists,
+    Shows,
+    SHOW_LENGTH
+)
+from counters import rebuild
+from queries import todays_datetime
+from geo import gazetteer
+from show_calendar import refresh_calendar
+
+BATCH_SIZE = 5000
+
+#  With their states, so geo.gazetteer finds them
+CITIES = [('Austin', 'TX'), ('Dallas', 'TX'), ('Houston', 'TX'),
+          ('New York', 'NY'), ('San Francisco', 'CA'), ('Seattle', 'WA'),
+          ('Chicago', 'IL'), ('Boston', 'MA'), ('Denver', 'CO'),
+          ('Miami', 'FL'), ('Portland', 'OR'), ('Nashville', 'TN'),
+          ('Atlanta', 'GA'), ('Phoenix', 'AZ'), ('Detroit', 'MI'),
+          ('New Orleans', 'LA')]
+
+WORDS = ['Blue', 'Electric', 'Velvet', 'Midnight', 'Golden', 'Silver',
+         'Black', 'Wild', 'Lonely', 'Crystal', 'Neon', 'Broken', 'Red',
+         'Hollow', 'Static', 'Paper', 'Iron', 'Stone', 'Echo', 'Sun']
+
+VENUE_WORDS = ['Hall', 'Room', 'Club', 'Theatre', 'Lounge', 'Tavern',
+               'Garden', 'Arena', 'Cellar', 'Bar']
+
+ARTIST_WORDS = ['Band', 'Collective', 'Trio', 'Quartet', 'Kids',
+                'Orchestra', 'Brothers', 'Sisters', 'Project', 'Machine']
+
+# fixed origin so the split between past and upcoming shows only
+# depends on the day the benchmark runs, not on the generated data
+EPOCH = datetime(2020, 1, 1)
+
+
+def insert(table, rows):
+    for i in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(table.insert(), rows[i:i + BATCH_SIZE])
+
+
+def generate(num_shows, seed=1):
+    rnd = random.Random(seed)
+    num_users = max(num_shows // 10, 8)
+    num_venues = max(num_users // 4, 2)
+
+    db.create_all()
+    existing = {g.name for g in Genres.query.all()}
+    db.session.add_all([Genres(name=g.name) for g in Genres_enum
+                        if g.name not in existing])
+    db.session.commit()
+    genre_ids = [g.id for g in Genres.query.order_by(Genres.id)]
+
+    first_id = (db.session.query(db.func.max(Users.id)).scalar() or 0) + 1
+    users, venues, artists, user_genres = [], [], [], []
+    for user_id in range(first_id, first_id + num_users):
+        is_venue = user_id - first_id < num_venues
+        city, state = rnd.choice(CITIES)
+        kind = VENUE_WORDS if is_venue else ARTIST_WORDS
+        users.append({
+            'id': user_id,
+            'type': 'Venue' if is_venue else 'Artist',
+            'name': f'{rnd.choice(WORDS)} {rnd.choice(WORDS)} '
+                    f'{rnd.choice(kind)} {user_id}',
+            'city': city,
+            'state': state,
+            'phone': f'{rnd.randint(200, 999)}-555-'
+                     f'{rnd.randint(0, 9999):04}',
+            'image_link': f'https://example.com/img/{user_id}.jpg',
+            'facebook_link': f'https://facebook.com/{user_id}',
+            'website': f'https://example.com/{user_id}',
+            'is_seeking': rnd.random() < 0.3,
+            'seeking_description': None
+        })
+        if is_venue:
+            latitude, longitude = gazetteer.geocode(city, state)
+            venues.append({'user_id': user_id,
+                           'address': f'{rnd.randint(1, 9999)} Main St',
+                           'latitude': latitude,
+                           'longitude': longitude})
+        else:
+            artists.append({'user_id': user_id})
+        for genre_id in rnd.sample(genre_ids, rnd.randint(1, 4)):
+            user_genres.append({'user_id': user_id, 'genre_id': genre_id})
+
+    insert(Users.__table__, users)
+    insert(Venues.__table__, venues)
+    insert(Artists.__table__, artists)
+    insert(User_genre.__table__, user_genres)
+
+    venue_ids = [v['user_id'] for v in venues]
+    artist_ids = [a['user_id'] for a in artists]
+    num_slots = timedelta(days=365 * 10) // SHOW_LENGTH
+    booked = set()  # no double bookings, see scheduling.py
+    for first in range(0, num_shows, BATCH_SIZE):  # a batch at a time
+        shows = []
+        while len(shows) < min(BATCH_SIZE, num_shows - first):
+            artist_id = rnd.choice(artist_ids)
+            venue_id = rnd.choice(venue_ids)
+            slot = rnd.randrange(num_slots)
+            if (artist_id, slot) in booked or (venue_id, slot) in booked:
+                continue
+            booked |= {(artist_id, slot), (venue_id, slot)}
+            shows.append({'artist_id': artist_id,
+                          'venue_id': venue_id,
+                          'start_time': EPOCH + slot * SHOW_LENGTH})
+        insert(Shows.__table__, shows)
+
+    rebuild(todays_datetime())  # fills the show counters
+    refresh_calendar()
+
+    if db.engine.dialect.name == 'postgresql':
+        # the ids were given explicitly, move the sequence past them
+        db.session.execute(db.text(
+            'SELECT setval(pg_get_serial_sequence(\'"User"\', \'id\'), '
+            'max(id)) FROM "User"'))
+    db.session.commit()
+
+    return num_users, num_shows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--shows', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--database-url',
+                        help='defaults to SQLALCHEMY_DATABASE_URI')
+    args = parser.parse_args()
+
+    from app import app
+    from config import engine_options
+    if args.database_url:
+        app.config['SQLALCHEMY_DATABASE_URI'] = args.database_url
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = \
+            engine_options(args.database_url)
+
+    with app.app_context():
+        started = time.perf_counter()
+        users, shows = generate(args.shows, args.seed)
+        print(f'{users} users and {shows} shows generated in '
+              f'{time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
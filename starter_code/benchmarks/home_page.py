@@ -0,0 +1,68 @@
+'''
+    Home page startup benchmark.
+
+    Times the home page of a freshly imported app:
+
+        cold      the first request, which loads the caches
+                  (warm_caches: the genres and the latest sign ups)
+        warm      the following requests, served from the sign up feed
+        reload    a request after the feed expired, which reloads it
+
+    and reports the latency and the queries of each.
+'''
+
+import argparse
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from benchmarks.driver import percentile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--database-url',
+                        help='defaults to SQLALCHEMY_DATABASE_URI')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='warm requests')
+    args = parser.parse_args()
+
+    from app import app
+    from config import engine_options
+    from sign_ups import KEY
+    if args.database_url:
+        app.config['SQLALCHEMY_DATABASE_URI'] = args.database_url
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = \
+            engine_options(args.database_url)
+
+    queries = [0]
+
+    def count_query(*args):
+        queries[0] += 1
+
+    event.listen(Engine, 'before_cursor_execute', count_query)
+    client = app.test_client()
+
+    def timed_requests(count):
+        ''' Returns (timings, queries per request) '''
+        queries[0] = 0
+        timings = []
+        for _ in range(count):
+            started = time.perf_counter()
+            client.get('/')
+            timings.append(time.perf_counter() - started)
+        return timings, queries[0] / count
+
+    results = [('cold', *timed_requests(1))]
+    results.append(('warm', *timed_requests(args.requests)))
+    app.extensions['sign_up_feed'].cache.delete(KEY)
+    results.append(('reload', *timed_requests(1)))
+
+    print(f'{"request":<10}{"p50 ms":>10}{"p99 ms":>10}{"queries":>10}')
+    for name, timings, per_request in results:
+        print(f'{name:<10}{percentile(timings, 0.50) * 1000:>10.2f}'
+              f'{percentile(timings, 0.99) * 1000:>10.2f}'
+              f'{per_request:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+# ----------------------------------------------------------------------------#
+# Bitmap filters.
+# ----------------------------------------------------------------------------#
+#  Optional in-process engine for the advanced user search
+#  (BITMAP_FILTERS in config.py).
+#
+#  The filters of the search have few values: 2 types, 52 states and 19
+#  genres. BitmapIndex keeps one bitmap per value, a Python int whose
+#  bit N is set when user N has it, so a filter set is answered with ANDs
+#  and ORs of a few ints:
+#
+#    (type AND state AND city) AND (genre 1 AND/OR genre 2 ...)
+#
+#  A bitmap takes (highest user id / 8) bytes, too much for each of the
+#  thousands of cities users type in: a city keeps the set of its user
+#  ids, turned into a bitmap when a search filters on it (the last
+#  CITY_BITMAPS of them are kept).
+#
+#  The facet counts are the number of bits of the result ANDed with each
+#  value's bitmap, and a page of results reads its ids from the result
+#  bits, then fetches only those rows.
+#
+#  The index is built from "User" and user_genre (two queries) by a
+#  background thread, IndexBuilder, started with the worker (the first
+#  request), and rebuilt by it every BITMAP_FILTERS_MAX_AGE seconds;
+#  searches never wait for a build and go to the database until the
+#  first one is done. The write paths in app.py keep it up to date
+#  meanwhile, like search.NgramIndex; the writes made while a build
+#  reads the database are replayed on its result. City filters with
+#  ILIKE wildcards (% or _) go to the database.
+# ----------------------------------------------------------------------------#
+
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from flask import current_app
+from models import db, User_genre, Users, Genres
+from queries import USER_COLUMNS
+
+try:
+    popcount = int.bit_count  # Python 3.10+
+except AttributeError:
+    def popcount(bitmap):
+        return bin(bitmap).count('1')
+
+
+def bitmap_of(ids):
+    ''' The bitmap of a set of user ids '''
+    if not ids:
+        return 0
+    bits = bytearray(max(ids) // 8 + 1)
+    for user_id in ids:
+        bits[user_id >> 3] |= 1 << (user_id & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def bitmap_keys(user_type, state, genres):
+    return [('type', user_type), ('state', state)] + \
+        [('genre', genre) for genre in genres]
+
+
+class BitmapIndex:
+
+    CITY_BITMAPS = 64
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()  # one build at a time
+        self.journal = None  # the writes made during a build
+        self.built_at = None
+        self.bitmaps = {}  # (facet, value) --> bitmap
+        self.cities = {}  # lower cased city --> {user id}
+        self.city_bitmaps = OrderedDict()  # lower cased city --> bitmap
+        self.users = {}  # user id --> (its keys in self.bitmaps, city)
+        self.all = 0
+
+    def build(self):
+        with self.build_lock:
+            with self.lock:
+                self.journal = []
+            try:
+                users = db.session.query(Users.id, Users.type, Users.state,
+                                         Users.city).all()
+                genres = db.session.query(User_genre.user_id, Genres.name)\
+                    .join(Genres, Genres.id == User_genre.genre_id).all()
+            except Exception:
+                with self.lock:
+                    self.journal = None
+                raise
+
+            user_genres = defaultdict(list)
+            for user_id, genre in genres:
+                user_genres[user_id].append(genre)
+
+            self.load((user_id, user_type, state, city,
+                       user_genres[user_id])
+                      for user_id, user_type, state, city in users)
+
+    def load(self, users):
+        ''' Replaces the content of the index by 'users', rows of (id,
+            type, state, city, genres), then replays the writes made
+            since build() started reading them '''
+        ids = defaultdict(list)  # (facet, value) --> [user id]
+        cities = defaultdict(set)
+        entries = {}
+        for user_id, user_type, state, city, genres in users:
+            keys = bitmap_keys(user_type, state, genres)
+            for key in keys:
+                ids[key].append(user_id)
+            city = (city or '').lower()
+            cities[city].add(user_id)
+            entries[user_id] = (keys, city)
+
+        # one bitmap per key: setting the bits one by one would copy the
+        # whole int for each of them
+        bitmaps = {key: bitmap_of(user_ids) for key, user_ids in ids.items()}
+        with self.lock:
+            self.bitmaps = bitmaps
+            self.cities = dict(cities)
+            self.city_bitmaps.clear()
+            self.users = entries
+            self.all = bitmap_of(entries)
+            self.built_at = time.time()
+            for user_id, user in self.journal or ():
+                self._remove(user_id)
+                if user is not None:
+                    self._add(user_id, *user)
+            self.journal = None
+
+    def _add(self, user_id, user_type, state, city, genres):
+        keys = bitmap_keys(user_type, state, genres)
+        bit = 1 << user_id
+        for key in keys:
+            self.bitmaps[key] = self.bitmaps.get(key, 0) | bit
+        city = (city or '').lower()
+        self.cities.setdefault(city, set()).add(user_id)
+        self.city_bitmaps.pop(city, None)
+        self.users[user_id] = (keys, city)
+        self.all |= bit
+
+    def _remove(self, user_id):
+        if user_id not in self.users:
+            return
+        keys, city = self.users.pop(user_id)
+        bit = 1 << user_id
+        for key in keys:
+            self.bitmaps[key] &= ~bit
+        self.cities[city].discard(user_id)
+        if not self.cities[city]:
+            del self.cities[city]
+        self.city_bitmaps.pop(city, None)
+        self.all &= ~bit
+
+    def add(self, user_id, user_type, state, city, genres):
+        ''' Adds a user, replacing its previous bits if any '''
+        with self.lock:
+            if self.journal is not None:
+                self.journal.append(
+                    (user_id, (user_type, state, city, list(genres))))
+            if self.built_at is not None:  # else the build picks it up
+                self._remove(user_id)
+                self._add(user_id, user_type, state, city, genres)
+
+    def remove(self, user_id):
+        with self.lock:
+            if self.journal is not None:
+                self.journal.append((user_id, None))
+            if self.built_at is not None:
+                self._remove(user_id)
+
+    def match(self, city=None, state=None, user_type=None, genres=(),
+              match_all=True):
+        ''' Bitmap of the users matching queries.user_search_filters()
+            with the same arguments. None for a city with wildcards. '''
+        if city and ('%' in city or '_' in city):
+            return None
+
+        with self.lock:
+            result = self.all
+            for key in (('type', user_type), ('state', state)):
+                if key[1]:
+                    result &= self.bitmaps.get(key, 0)
+            if city:
+                result &= self.city_bitmap(city.lower())
+            if genres:
+                bitmaps = [self.bitmaps.get(('genre', g), 0) for g in genres]
+                played = bitmaps[0]
+                for bitmap in bitmaps[1:]:
+                    played = played & bitmap if match_all else played | bitmap
+                result &= played
+        return result
+
+    def city_bitmap(self, city):
+        bitmap = self.city_bitmaps.get(city)
+        if bitmap is None:
+            bitmap = bitmap_of(self.cities.get(city, ()))
+            self.city_bitmaps[city] = bitmap
+            if len(self.city_bitmaps) > self.CITY_BITMAPS:
+                self.city_bitmaps.popitem(last=False)
+        else:
+            self.city_bitmaps.move_to_end(city)
+        return bitmap
+
+    def page(self, bitmap, limit, after=None):
+        ''' The first 'limit' ids of 'bitmap' above 'after', and the cursor
+            of the next page (None on the last page) '''
+        first = (after or 0) + 1
+        bitmap >>= first
+        ids = []
+        # the bits are read a window at a time: the operations on a
+        # window cost its size, those on the whole bitmap cost the index
+        # size. Windows double while they come back empty.
+        window = 4096
+        while bitmap and len(ids) <= limit:
+            bits = bitmap & ((1 << window) - 1)
+            empty = not bits
+            while bits and len(ids) <= limit:
+                low = bits & -bits
+                ids.append(first + low.bit_length() - 1)
+                bits ^= low
+            bitmap >>= window
+            first += window
+            if empty:
+                window *= 2
+        if len(ids) > limit:
+            return ids[:limit], ids[limit - 1]
+        return ids, None
+
+    def facets(self, bitmap):
+        ''' {facet: {value: number of users}}, as facets.count_facets() '''
+        facets = {'genre': {}, 'state': {}, 'type': {}}
+        with self.lock:
+            for (facet, value), users in self.bitmaps.items():
+                if facet in facets and value:
+                    count = popcount(bitmap & users)
+                    if count:
+                        facets[facet][value] = count
+        return facets
+
+    def memory(self):
+        ''' Bytes used by the bitmaps and the city sets and bitmaps '''
+        return sum(bitmap.__sizeof__() for bitmap in self.bitmaps.values()) \
+            + sum(ids.__sizeof__() for ids in self.cities.values()) \
+            + sum(bitmap.__sizeof__()
+                  for bitmap in self.city_bitmaps.values())
+
+
+class IndexBuilder:
+    ''' Builds an in-process index (bitmaps.BitmapIndex, search.NgramIndex,
+        geo.GeoGridIndex) in a daemon thread, then again whenever it is
+        'interval' seconds old: it picks up the writes of the other
+        workers and of the flask commands. Started lazily, so each
+        worker process (after a fork) runs its own. '''
+
+    def __init__(self, app, index, interval, name='bitmap-filters'):
+        self.app = app
+        self.index = index
+        self.interval = interval
+        self.name = name
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run,
+                                               name=self.name,
+                                               daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            # an index a request built on first use is left alone
+            # until it is 'interval' old
+            built_at = self.index.built_at
+            if built_at is not None and \
+                    time.time() < built_at + self.interval:
+                time.sleep(max(built_at + self.interval - time.time(), 0))
+                continue
+            with self.app.app_context():
+                try:
+                    self.index.build()
+                except Exception:
+                    self.app.logger.exception(f'{self.name} build failed')
+                    time.sleep(self.interval)
+                finally:
+                    db.session.remove()
+
+
+def init_bitmap_filters(app):
+    if app.config.get('BITMAP_FILTERS'):
+        index = BitmapIndex()
+        app.extensions['bitmap_filters'] = index
+        app.extensions['bitmap_filters_builder'] = IndexBuilder(
+            app, index, app.config.get('BITMAP_FILTERS_MAX_AGE', 300))
+
+
+def build_bitmap_filters():
+    ''' Starts the background builds, if BITMAP_FILTERS is on '''
+    builder = current_app.extensions.get('bitmap_filters_builder')
+    if builder is not None:
+        builder.start()
+
+
+def bitmap_filters():
+    ''' The index, or None when BITMAP_FILTERS is off or its first build
+        is not done yet '''
+    index = current_app.extensions.get('bitmap_filters')
+    if index is None:
+        return None
+    build_bitmap_filters()
+    return index if index.built_at is not None else None
+
+
+def index_user_filters(user_id, user_type, state, city, genres):
+    ''' Called after a write that adds or changes a user '''
+    index = current_app.extensions.get('bitmap_filters')
+    if index is not None:
+        index.add(user_id, user_type, state, city, genres)
+
+
+def unindex_user_filters(user_id):
+    index = current_app.extensions.get('bitmap_filters')
+    if index is not None:
+        index.remove(user_id)
+
+
+def users_by_ids(ids, fields=('name', 'type', 'image_link')):
+    ''' The rows of 'ids', ordered by id, as queries.page_users() '''
+    fields = ['id'] + [f for f in fields if f != 'id']
+    if not ids:
+        return []
+    return db.session.query(*[USER_COLUMNS[f] for f in fields])\
+        .filter(Users.id.in_(ids))\
+        .order_by(Users.id).all()
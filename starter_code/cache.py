@@ -0,0 +1,153 @@
+# ----------------------------------------------------------------------------#
+# Cache.
+# ----------------------------------------------------------------------------#
+#  Read-through cache of the venue/artist profile data (the dict built by
+#  queries.load_profile), so that profile pages are rendered without
+#  querying the database.
+#
+#  Backends:
+#    LRUCache   - in-process, the default
+#    RedisCache - any Redis compatible server, shared by all the workers.
+#                 Set PROFILE_CACHE_REDIS_URL in config.py to use it
+#                 (needs the 'redis' package).
+#
+#  The key holds the day used as the past/upcoming boundary, so a
+#  profile cached yesterday is never served today. The write paths in
+#  app.py delete the keys of the profiles they change; with LRUCache only
+#  in their own worker, so entries of both backends also expire after
+#  PROFILE_CACHE_TTL seconds, which bounds how long the other workers
+#  serve a stale profile.
+# ----------------------------------------------------------------------------#
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from models import db
+from queries import load_profile, todays_datetime
+from replicas import primary
+
+
+class LRUCache:
+
+    def __init__(self, max_entries, ttl):
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key --> (expiry time, value)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def update(self, key, change):
+        ''' Replaces the value of 'key' by change(value), atomically. A
+            missing key is left missing. '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] >= time.monotonic():
+                self.entries[key] = (time.monotonic() + self.ttl,
+                                     change(entry[1]))
+                self.entries.move_to_end(key)
+
+
+class RedisCache:
+
+    def __init__(self, url, ttl):
+        import redis  # optional dependency
+        self.redis = redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.client.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value):
+        self.client.set(key, json.dumps(value), ex=self.ttl)
+
+    def update(self, key, change):
+        ''' Replaces the value of 'key' by change(value), atomically
+            between all the clients: WATCH/MULTI, run again when another
+            client wrote the key in between. A missing key is left
+            missing. '''
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    value = pipe.get(key)
+                    if value is None:
+                        pipe.unwatch()
+                        return
+                    pipe.multi()
+                    pipe.set(key, json.dumps(change(json.loads(value))),
+                             ex=self.ttl)
+                    pipe.execute()
+                    return
+                except self.redis.WatchError:
+                    continue
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*keys)
+
+
+def make_cache(config):
+    if config.get('PROFILE_CACHE_REDIS_URL'):
+        return RedisCache(config['PROFILE_CACHE_REDIS_URL'],
+                          config['PROFILE_CACHE_TTL'])
+    return LRUCache(config['PROFILE_CACHE_SIZE'], config['PROFILE_CACHE_TTL'])
+
+
+def profile_key(user_type, user_id, today):
+    ''' 'user_id' may come from a URL or a form: '5' and 5 are the same
+        key '''
+    return f'profile:{user_type}:{int(user_id)}:{today:%Y-%m-%d}'
+
+
+def init_profile_cache(app):
+    app.extensions['profile_cache'] = make_cache(app.config)
+
+
+def cached_profile(user_id, user_type):
+    ''' load_profile() through the profile cache '''
+    profile_cache = current_app.extensions['profile_cache']
+    key = profile_key(user_type, user_id, todays_datetime())
+    data = profile_cache.get(key)
+    if data is None:
+        # from the primary: a lagging replica could cache a profile the
+        # write paths have already invalidated
+        with primary():
+            data = load_profile(user_id, user_type, todays_datetime())
+        db.session.close()
+        if data is not None:
+            profile_cache.set(key, data)
+    return data
+
+
+def invalidate_profiles(users):
+    ''' 'users' is a set of (user type, user id) '''
+    today = todays_datetime()
+    current_app.extensions['profile_cache'].delete(
+        *[profile_key(user_type, user_id, today)
+          for user_type, user_id in users])
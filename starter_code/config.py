@@ -6,5 +6,123 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 # Enable debug mode.
 DEBUG = True
 
-SQLALCHEMY_DATABASE_URI = 'postgresql://postgres@localhost:5432/fyyur'
+SQLALCHEMY_DATABASE_URI = os.environ.get(
+    'DATABASE_URL', 'postgresql://postgres@localhost:5432/fyyur')
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# Connection pool, per worker process. Size it so that
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) stays under the server's
+# max_connections (or PgBouncer's pool).
+#
+# PGBOUNCER=1 is for a PgBouncer in transaction pooling mode: it rejects
+# the 'options' startup parameter and can not keep per connection state,
+# so the statement timeout must then be set on the database role
+# (ALTER ROLE ... SET statement_timeout). psycopg2 uses no server side
+# prepared statements; the asyncpg adapter of SQLAlchemy 1.4 always
+# does, so async mode is refused with PGBOUNCER (async_queries.py).
+PGBOUNCER = os.environ.get('PGBOUNCER') == '1'
+
+
+def engine_options(database_uri):
+    ''' SQLAlchemy engine options for 'database_uri', from the
+        environment. Only PostgreSQL gets a tuned pool '''
+    if not database_uri.startswith('postgresql'):
+        return {}
+
+    options = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        # seconds to wait for a free connection before failing
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        # replace connections older than this (failovers, idle kills)
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        # test connections on checkout, drops the dead ones
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+    }
+    timeout = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000))
+    if database_uri.startswith('postgresql+asyncpg'):
+        # asyncpg takes the setting as server_settings
+        if not PGBOUNCER:
+            options['connect_args'] = {
+                'server_settings': {'statement_timeout': str(timeout)}}
+    elif not PGBOUNCER:
+        options['connect_args'] = {
+            'options': f'-c statement_timeout={timeout}'}
+    return options
+
+
+SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+
+# Read replicas (replicas.py), as comma separated URLs in
+# DATABASE_REPLICA_URLS. Read-only requests read from them round-robin,
+# the rest goes to SQLALCHEMY_DATABASE_URI.
+SQLALCHEMY_REPLICA_URIS = [
+    uri for uri in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+    if uri]
+REPLICA_CHECK_INTERVAL = 10  # seconds between health checks of a replica
+REPLICA_MAX_LAG = 5  # seconds, a replica further behind is skipped
+# after a write, the client reads from the primary for this long
+READ_YOUR_WRITES_SECONDS = 10
+
+# Async mode (async_queries.py): the independent queries of a read path
+# (the 3 of a profile page, a shows page and its count) run concurrently
+# on an asyncio engine. Needs asyncpg (aiosqlite on a SQLite file), and
+# can not run on an in-memory SQLite database or through PgBouncer.
+ASYNC_QUERIES = os.environ.get('ASYNC_QUERIES') == '1'
+
+# Pagination of the shows listing and search.
+SHOWS_PER_PAGE = 30
+MAX_SHOWS_PER_PAGE = 100
+
+# Results per page of the venue/artist name searches.
+SEARCH_RESULTS_PER_PAGE = 20
+# Without pg_trgm (SQLite), they use an in-process index, rebuilt in the
+# background every USER_INDEX_MAX_AGE seconds to pick up the users added
+# elsewhere.
+USER_INDEX_MAX_AGE = 300
+
+# Cache of the venue/artist profile pages data. In-process LRU by
+# default; set a Redis URL (redis://localhost:6379/0) to share it
+# between workers. Entries expire after PROFILE_CACHE_TTL seconds.
+PROFILE_CACHE_SIZE = 2048
+PROFILE_CACHE_REDIS_URL = os.environ.get('PROFILE_CACHE_REDIS_URL')
+PROFILE_CACHE_TTL = 300
+
+# Latest sign ups of the home page (sign_ups.py), kept in the cache
+# backend above and reloaded when older than LATEST_SIGN_UPS_MAX_AGE
+# seconds.
+LATEST_SIGN_UPS = 10
+LATEST_SIGN_UPS_MAX_AGE = 60
+
+# City coordinates of the venues (geo.py): a CSV of
+# city,state,latitude,longitude.
+GAZETTEER_PATH = os.path.join(basedir, 'data', 'gazetteer.csv')
+# Without the earthdistance extension, the venue searches use an
+# in-process grid, rebuilt in the background every VENUE_GRID_MAX_AGE
+# seconds to pick up the venues geocoded elsewhere.
+VENUE_GRID_MAX_AGE = 300
+
+# Facet counts of the advanced user search (facets.py), kept in the
+# cache backend above for this many seconds per filter set.
+FACETS_MAX_AGE = 60
+
+# In-process bitmap index of the advanced user search filters
+# (bitmaps.py), rebuilt from the database in the background every
+# BITMAP_FILTERS_MAX_AGE seconds.
+BITMAP_FILTERS = os.environ.get('BITMAP_FILTERS') == '1'
+BITMAP_FILTERS_MAX_AGE = 300
+
+# Pagination of the JSON API (api.py).
+API_PAGE_SIZE = 50
+MAX_API_PAGE_SIZE = 200
+# Most shows POST /api/v1/shows books at once (scheduling.py).
+MAX_SHOWS_PER_SCHEDULE = 5000
+
+# On PostgreSQL, seconds between a write and the refresh of the show
+# calendar view it changed (show_calendar.py).
+CALENDAR_REFRESH_SECONDS = 30
+
+# Request instrumentation (profiling.py): query count, SQL and template
+# time per request, in a Server-Timing header, the log and /_metrics.
+PROFILING = os.environ.get('PROFILING') == '1'
+PROFILING_SLOWEST = 3  # slowest statements logged per request
@@ -0,0 +1,188 @@
+# ----------------------------------------------------------------------------#
+# Show counters.
+# ----------------------------------------------------------------------------#
+#  Venues and Artists keep their number of upcoming and past shows
+#  (upcoming_shows_count, past_shows_count), so the listings and the
+#  searches read them instead of counting the shows of every row.
+#
+#  The counters split the shows at Show_counters.boundary, a midnight:
+#
+#    - count_new_shows() adds shows to the counters, in the transaction
+#      that inserts them (create_show_submission, flask import)
+#    - recount() recomputes the counters of some users, in the
+#      transaction that deletes their shows (delete_user)
+#    - flask roll-show-counters moves the shows that started since the
+#      boundary from upcoming to past, and the boundary to today. Run it
+#      daily, right after midnight (cron)
+#    - flask check-show-counters compares every counter with the shows
+#      and lists the wrong ones; --fix rebuilds them all. Run it with
+#      --fix once after adding the columns to an existing database
+# ----------------------------------------------------------------------------#
+
+from collections import defaultdict
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, or_, select, update
+from models import db, Venues, Artists, Shows, Show_counters
+from queries import todays_datetime
+
+#  The counted tables, with the column of Shows that points to them
+COUNTED = ((Venues, Shows.venue_id), (Artists, Shows.artist_id))
+
+
+def update_counters(model):
+    ''' UPDATE of 'model' that leaves the objects of the session alone:
+        they do not load the counters '''
+    return update(model).execution_options(synchronize_session=False)
+
+
+#  Adds to the counters of one user, run as an executemany
+ADD_COUNTS = {
+    model: update_counters(model)
+    .where(model.user_id == bindparam('counted_id'))
+    .values(upcoming_shows_count=model.upcoming_shows_count +
+            bindparam('upcoming'),
+            past_shows_count=model.past_shows_count + bindparam('past'))
+    for model, _ in COUNTED
+}
+
+
+def get_boundary(lock=None):
+    '''
+        The current boundary. lock='read' keeps a roll forward from
+        moving it until the transaction ends, lock='write' keeps the
+        writes from counting shows meanwhile (ignored by SQLite).
+        The first call on a new database sets it to today.
+    '''
+    query = db.session.query(Show_counters.boundary)
+    if lock:
+        query = query.with_for_update(read=lock == 'read')
+
+    boundary = query.scalar()
+    if boundary is None:
+        boundary = todays_datetime()
+        db.session.add(Show_counters(id=1, boundary=boundary))
+        db.session.flush()
+    return boundary
+
+
+def count_new_shows(shows):
+    ''' Adds 'shows' (dicts with artist_id, venue_id and start_time) to
+        the counters of their artists and venues '''
+    boundary = get_boundary(lock='read')
+
+    for model, column in COUNTED:
+        counts = defaultdict(lambda: {'upcoming': 0, 'past': 0})
+        for show in shows:
+            side = 'past' if show['start_time'] <= boundary else 'upcoming'
+            counts[show[column.key]][side] += 1
+
+        if counts:
+            db.session.execute(ADD_COUNTS[model],
+                               [dict(counted_id=user_id, **user_counts)
+                                for user_id, user_counts in counts.items()])
+
+
+def shows_count(model, column, condition):
+    ''' Correlated count of the shows of each row of 'model' '''
+    return select(db.func.count(Shows.id))\
+        .where(column == model.user_id, condition)\
+        .scalar_subquery()
+
+
+def recount(user_ids=None, boundary=None):
+    ''' Recomputes the counters of 'user_ids' (all the users if None)
+        from their shows '''
+    boundary = boundary or get_boundary(lock='read')
+
+    for model, column in COUNTED:
+        statement = update_counters(model).values(
+            upcoming_shows_count=shows_count(model, column,
+                                             Shows.start_time > boundary),
+            past_shows_count=shows_count(model, column,
+                                         Shows.start_time <= boundary))
+        if user_ids is not None:
+            statement = statement.where(model.user_id.in_(list(user_ids)))
+        db.session.execute(statement)
+
+
+def rebuild(today):
+    ''' Recomputes every counter, split at 'today' '''
+    get_boundary(lock='write')
+    db.session.execute(update(Show_counters).values(boundary=today))
+    recount(boundary=today)
+
+
+def roll_forward(today):
+    ''' Moves the shows started between the boundary and 'today' from
+        upcoming to past. Returns the number of shows moved. '''
+    boundary = get_boundary(lock='write')
+    if today <= boundary:
+        return 0
+
+    started = (Shows.start_time > boundary, Shows.start_time <= today)
+    for model, column in COUNTED:
+        moved = select(column.label('user_id'),
+                       db.func.count(Shows.id).label('shows'))\
+            .where(*started)\
+            .group_by(column)\
+            .subquery()
+        shows = select(moved.c.shows)\
+            .where(moved.c.user_id == model.user_id)\
+            .scalar_subquery()
+
+        db.session.execute(
+            update_counters(model)
+            .where(model.user_id.in_(select(moved.c.user_id)))
+            .values(upcoming_shows_count=model.upcoming_shows_count - shows,
+                    past_shows_count=model.past_shows_count + shows))
+
+    db.session.execute(update(Show_counters).values(boundary=today))
+    return db.session.query(db.func.count(Shows.id))\
+        .filter(*started).scalar()
+
+
+def wrong_counters():
+    ''' Returns (user id, stored upcoming, stored past, upcoming, past)
+        for every counter that does not match the shows '''
+    boundary = get_boundary()
+
+    wrong = []
+    for model, column in COUNTED:
+        upcoming = shows_count(model, column, Shows.start_time > boundary)
+        past = shows_count(model, column, Shows.start_time <= boundary)
+        wrong += db.session.query(model.user_id,
+                                  model.upcoming_shows_count,
+                                  model.past_shows_count,
+                                  upcoming,
+                                  past)\
+            .filter(or_(model.upcoming_shows_count != upcoming,
+                        model.past_shows_count != past))\
+            .order_by(model.user_id).all()
+    return wrong
+
+
+@click.command('roll-show-counters')
+@with_appcontext
+def roll_command():
+    ''' Moves the shows started since the last run to the past. '''
+    moved = roll_forward(todays_datetime())
+    db.session.commit()
+    click.echo(f'{moved} shows moved from upcoming to past')
+
+
+@click.command('check-show-counters')
+@click.option('--fix', is_flag=True, help='Rebuild all the counters.')
+@with_appcontext
+def check_command(fix):
+    ''' Lists the show counters that do not match the shows. '''
+    wrong = wrong_counters()
+    for user_id, upcoming, past, real_upcoming, real_past in wrong:
+        click.echo(f'user {user_id}: {upcoming} upcoming / {past} past, '
+                   f'should be {real_upcoming} / {real_past}')
+    click.echo(f'{len(wrong)} wrong counters')
+
+    if fix:
+        rebuild(todays_datetime())
+        db.session.commit()
+        click.echo('counters rebuilt')
@@ -0,0 +1,108 @@
+# ----------------------------------------------------------------------------#
+# Export.
+# ----------------------------------------------------------------------------#
+#  Streams every show or user as CSV or NDJSON (one JSON object per line):
+#
+#    GET /export/shows.csv  /export/shows.ndjson  (?gzip=1 to compress)
+#    GET /export/users.csv  /export/users.ndjson
+#    flask export shows|users FILE [--format csv|ndjson] [--gzip]
+#
+#  Rows are read from a server side cursor (yield_per) and written as
+#  they arrive, so memory stays flat whatever the size of the table.
+# ----------------------------------------------------------------------------#
+
+import csv
+import io
+import json
+import zlib
+import click
+from flask import Blueprint, Response, request, stream_with_context
+from flask.cli import with_appcontext
+from models import db, Users, Shows
+from queries import SHOW_COLUMNS, USER_COLUMNS, shows_query
+
+
+export = Blueprint('export', __name__, url_prefix='/export')
+
+BATCH_SIZE = 1000  # rows fetched per round trip, and written per chunk
+
+FORMATS = {'csv': 'text/csv',
+           'ndjson': 'application/x-ndjson'}
+
+
+def export_query(kind):
+    ''' Returns (field names, query streaming every row) '''
+    if kind == 'shows':
+        fields = list(SHOW_COLUMNS)
+        query = shows_query(fields).order_by(Shows.start_time, Shows.id)
+    else:
+        fields = list(USER_COLUMNS)
+        query = db.session.query(*USER_COLUMNS.values()).order_by(Users.id)
+
+    return fields, query.yield_per(BATCH_SIZE)
+
+
+def csv_chunks(fields, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def ndjson_chunks(fields, rows):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(fields, row)), default=str))
+        if len(lines) == BATCH_SIZE:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def encoded_chunks(kind, format, compress):
+    ''' Yields the export as bytes, gzipped if 'compress' '''
+    fields, rows = export_query(kind)
+    chunks = csv_chunks if format == 'csv' else ndjson_chunks
+
+    gzip = zlib.compressobj(wbits=31) if compress else None  # gzip format
+    for chunk in chunks(fields, rows):
+        data = chunk.encode()
+        yield gzip.compress(data) if gzip else data
+    if gzip:
+        yield gzip.flush()
+
+
+@export.route('/<any(shows, users):kind>.<any(csv, ndjson):format>')
+def export_file(kind, format):
+    compress = request.args.get('gzip', type=int) == 1
+
+    headers = {'Content-Disposition':
+               f'attachment; filename={kind}.{format}'}
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+
+    return Response(stream_with_context(
+                        encoded_chunks(kind, format, compress)),
+                    mimetype=FORMATS[format],
+                    headers=headers)
+
+
+@click.command('export')
+@click.argument('kind', type=click.Choice(['shows', 'users']))
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--format', 'format', type=click.Choice(list(FORMATS)),
+              default='csv', show_default=True)
+@click.option('--gzip', 'compress', is_flag=True)
+@with_appcontext
+def export_command(kind, path, format, compress):
+    ''' Writes every show or user to a CSV or NDJSON file. '''
+    with open(path, 'wb') as file:
+        for chunk in encoded_chunks(kind, format, compress):
+            file.write(chunk)
@@ -0,0 +1,127 @@
+# ----------------------------------------------------------------------------#
+# Search facets.
+# ----------------------------------------------------------------------------#
+#  The advanced user search shows, next to its results, how many of the
+#  matching users play each genre, live in each state and are venues or
+#  artists, so the next refinement is not a guess.
+#
+#  The three breakdowns come from one statement: GROUPING SETS on
+#  PostgreSQL, which reads the matching users once, and a UNION ALL of
+#  three GROUP BYs elsewhere.
+#
+#  They are cached per filter signature in the cache backend of cache.py,
+#  for FACETS_MAX_AGE seconds. The user writes of app.py bump a
+#  generation number that is part of the key, so their own worker (all
+#  of them, with Redis) stops serving the counts they changed.
+# ----------------------------------------------------------------------------#
+
+import hashlib
+import json
+import time
+from flask import current_app
+from sqlalchemy import literal, select, union_all
+from models import db, User_genre, Users, Genres
+from queries import user_search_filters
+from cache import make_cache
+
+FACETS = ('genre', 'state', 'type')
+GENERATION_KEY = 'facets:generation'
+
+
+def facets_statement(filters, dialect):
+    ''' Rows of (facet, value, number of users) on SQLite, of (genre,
+        state, type, number of users, grouping of genre, grouping of
+        state) on PostgreSQL '''
+    if dialect == 'postgresql':
+        # a user with several genres is on several joined rows
+        return select(Genres.name,
+                      Users.state,
+                      Users.type,
+                      db.func.count(db.distinct(Users.id)),
+                      db.func.grouping(Genres.name),
+                      db.func.grouping(Users.state))\
+            .select_from(Users)\
+            .outerjoin(User_genre, User_genre.user_id == Users.id)\
+            .outerjoin(Genres, Genres.id == User_genre.genre_id)\
+            .where(*filters)\
+            .group_by(db.func.grouping_sets(Genres.name,
+                                            Users.state,
+                                            Users.type))
+
+    by_genre = select(literal('genre'), Genres.name,
+                      db.func.count(db.distinct(Users.id)))\
+        .select_from(Users)\
+        .join(User_genre, User_genre.user_id == Users.id)\
+        .join(Genres, Genres.id == User_genre.genre_id)\
+        .where(*filters)\
+        .group_by(Genres.name)
+    by_state = select(literal('state'), Users.state, db.func.count(Users.id))\
+        .where(*filters)\
+        .group_by(Users.state)
+    by_type = select(literal('type'), Users.type, db.func.count(Users.id))\
+        .where(*filters)\
+        .group_by(Users.type)
+    return union_all(by_genre, by_state, by_type)
+
+
+def count_facets(search):
+    ''' {facet: {value: number of users}} of the users matching 'search'
+        (the arguments of queries.user_search_filters) '''
+    filters = user_search_filters(**search)
+    dialect = db.engine.dialect.name
+    rows = db.session.execute(facets_statement(filters, dialect)).all()
+
+    facets = {facet: {} for facet in FACETS}
+    for row in rows:
+        if dialect == 'postgresql':
+            genre, state, user_type, count, by_genre, by_state = row
+            if by_genre == 0:
+                facet, value = 'genre', genre
+            elif by_state == 0:
+                facet, value = 'state', state
+            else:
+                facet, value = 'type', user_type
+        else:
+            facet, value, count = row
+        if value is not None:  # users without genres
+            facets[facet][value] = count
+    return facets
+
+
+class FacetCache:
+
+    def __init__(self, cache, max_age):
+        self.cache = cache
+        self.max_age = max_age
+
+    def key(self, search):
+        signature = json.dumps(search, sort_keys=True)
+        generation = self.cache.get(GENERATION_KEY) or 0
+        return f'facets:{generation}:' \
+               f'{hashlib.sha1(signature.encode()).hexdigest()}'
+
+    def get(self, search):
+        key = self.key(search)
+        entry = self.cache.get(key)
+        if entry is None or time.time() - entry['loaded_at'] > self.max_age:
+            entry = {'loaded_at': time.time(), 'facets': count_facets(search)}
+            self.cache.set(key, entry)
+        return entry['facets']
+
+    def changed(self):
+        ''' Called after a write that changes the users or their genres '''
+        self.cache.set(GENERATION_KEY,
+                       (self.cache.get(GENERATION_KEY) or 0) + 1)
+
+
+def init_facets(app):
+    app.extensions['facets'] = FacetCache(
+        make_cache(app.config), app.config.get('FACETS_MAX_AGE', 60))
+
+
+def search_facets(search):
+    return current_app.extensions['facets'].get(search)
+
+
+def facets_changed():
+    current_app.extensions['facets'].changed()
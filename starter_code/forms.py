@@ -208,6 +208,12 @@ class Advance_user_search_form(FlaskForm):
         'genres',
         choices=Genres_enum.choices()
     )
+    genres_match = SelectField(
+        'genres_match', choices=[
+                    ('all', 'All selected genres'),
+                    ('any', 'Any selected genre')
+                ]
+    )
     city = StringField(
         'city', validators=[Optional(strip_whitespace=True)]
     )
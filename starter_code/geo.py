@@ -0,0 +1,367 @@
+# ----------------------------------------------------------------------------#
+# Geo.
+# ----------------------------------------------------------------------------#
+#  Venue coordinates and the "venues near" searches of the API.
+#
+#  Venues get the coordinates of their city from a local gazetteer file
+#  (GAZETTEER_PATH, a CSV of city,state,latitude,longitude), with no
+#  network call: when they are created or change city, and for the
+#  existing ones with
+#
+#    flask geocode-venues [--all]
+#
+#  Venues whose city is not in the gazetteer have no coordinates and are
+#  never found by the searches.
+#
+#  On PostgreSQL with the cube and earthdistance extensions, the searches
+#  run on a GiST index of ll_to_earth(latitude, longitude) (models.py).
+#  Otherwise they use GeoGridIndex, an in-process grid of the venues'
+#  coordinates. Like search.NgramIndex it is built from the database on
+#  first use and kept up to date by the write paths in app.py; the
+#  venues added or geocoded by other workers, flask import and flask
+#  geocode-venues are picked up when it is rebuilt in the background,
+#  every VENUE_GRID_MAX_AGE seconds (bitmaps.IndexBuilder).
+# ----------------------------------------------------------------------------#
+
+import csv
+import math
+import threading
+import time
+from collections import defaultdict
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, text, update
+from models import db, Users, Venues
+from bitmaps import IndexBuilder
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def place_key(city, state):
+    return ' '.join(city.lower().split()), state.upper().strip()
+
+
+class Gazetteer:
+    ''' (city, state) --> (latitude, longitude), loaded on first use '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.places = None
+
+    def load(self, path):
+        places = {}
+        with open(path, newline='') as file:
+            for row in csv.DictReader(file):
+                places[place_key(row['city'], row['state'])] = \
+                    (float(row['latitude']), float(row['longitude']))
+        with self.lock:
+            self.places = places
+
+    def geocode(self, city, state):
+        ''' Returns (latitude, longitude), or None for an unknown city '''
+        if self.places is None:
+            self.load(current_app.config['GAZETTEER_PATH'])
+        return self.places.get(place_key(city or '', state or ''))
+
+
+gazetteer = Gazetteer()
+
+
+def locate(venue, city, state):
+    ''' Sets the coordinates of a Venues row from its city '''
+    venue.latitude, venue.longitude = \
+        gazetteer.geocode(city, state) or (None, None)
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    ''' Great circle distance (haversine) '''
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def bounding_boxes(latitude, longitude, km):
+    '''
+        [(south, west, north, east)] covering the circle of radius 'km':
+        one box, or two when the circle crosses the antimeridian. A
+        circle over a pole covers every longitude up to it.
+    '''
+    lat_delta = km / KM_PER_DEGREE
+    south, north = latitude - lat_delta, latitude + lat_delta
+    if south <= -90 or north >= 90:
+        return [(max(south, -90), -180, min(north, 90), 180)]
+
+    # the meridians tangent to the circle
+    lon_delta = math.degrees(math.asin(
+        min(math.sin(math.radians(lat_delta)) /
+            math.cos(math.radians(latitude)), 1)))
+    west, east = longitude - lon_delta, longitude + lon_delta
+    if east - west >= 360:
+        return [(south, -180, north, 180)]
+    if west < -180:
+        return [(south, west + 360, north, 180), (south, -180, north, east)]
+    if east > 180:
+        return [(south, west, north, 180), (south, -180, north, east - 360)]
+    return [(south, west, north, east)]
+
+
+class GeoGridIndex:
+    '''
+        Grid of the venues' coordinates, in cells of CELL degrees:
+
+            (cell row, cell column) --> {venue_id: (latitude, longitude)}
+
+        A box search only reads the cells the box overlaps; a radius
+        search is a box search on the circle's bounding boxes, followed
+        by the exact distance check.
+    '''
+
+    CELL = 0.5  # degrees, about 55 km of latitude
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()  # one build at a time
+        self.journal = None  # the writes made during a build
+        self.built_at = None
+        self.cells = defaultdict(dict)
+        self.venues = {}  # venue_id --> cell
+
+    def cell(self, latitude, longitude):
+        return (math.floor(latitude / self.CELL),
+                math.floor(longitude / self.CELL))
+
+    def build(self):
+        with self.build_lock:
+            self._build()
+
+    def build_once(self):
+        ''' Builds the index on first use '''
+        with self.build_lock:
+            if self.built_at is None:
+                self._build()
+
+    def _build(self):
+        with self.lock:
+            self.journal = []
+        try:
+            venues = db.session.query(Venues.user_id,
+                                      Venues.latitude,
+                                      Venues.longitude)\
+                .filter(Venues.latitude.isnot(None),
+                        Venues.longitude.isnot(None)).all()
+        except Exception:
+            with self.lock:
+                self.journal = None
+            raise
+
+        with self.lock:
+            self.cells.clear()
+            self.venues.clear()
+            for venue in venues:
+                self._add(*venue)
+            # the writes made since the query, as bitmaps.BitmapIndex
+            for venue_id, location in self.journal:
+                self._remove(venue_id)
+                if location is not None:
+                    self._add(venue_id, *location)
+            self.journal = None
+            self.built_at = time.time()
+
+    def _add(self, venue_id, latitude, longitude):
+        cell = self.cell(latitude, longitude)
+        self.cells[cell][venue_id] = (latitude, longitude)
+        self.venues[venue_id] = cell
+
+    def _remove(self, venue_id):
+        cell = self.venues.pop(venue_id, None)
+        if cell is None:
+            return
+        del self.cells[cell][venue_id]
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def add(self, venue_id, latitude, longitude):
+        ''' Adds a venue, replacing its previous entry if any. A venue
+            without coordinates is removed '''
+        if latitude is None or longitude is None:
+            self.remove(venue_id)
+            return
+        with self.lock:
+            if self.journal is not None:
+                self.journal.append((venue_id, (latitude, longitude)))
+            if self.built_at is not None:  # else the build picks it up
+                self._remove(venue_id)
+                self._add(venue_id, latitude, longitude)
+
+    def remove(self, venue_id):
+        with self.lock:
+            if self.journal is not None:
+                self.journal.append((venue_id, None))
+            if self.built_at is not None:
+                self._remove(venue_id)
+
+    def in_box(self, south, west, north, east):
+        ''' Returns {venue_id: (latitude, longitude)} inside the box '''
+        if self.built_at is None:
+            self.build_once()
+
+        (first_row, first_column) = self.cell(south, west)
+        (last_row, last_column) = self.cell(north, east)
+        found = {}
+        with self.lock:
+            for row in range(first_row, last_row + 1):
+                for column in range(first_column, last_column + 1):
+                    for venue_id, (lat, lon) in \
+                            self.cells.get((row, column), {}).items():
+                        if south <= lat <= north and west <= lon <= east:
+                            found[venue_id] = (lat, lon)
+        return found
+
+    def near(self, latitude, longitude, km):
+        ''' Returns [(venue_id, distance in km)], closest first '''
+        found = {}
+        for box in bounding_boxes(latitude, longitude, km):
+            found.update(self.in_box(*box))
+        distances = [(distance_km(latitude, longitude, lat, lon), venue_id)
+                     for venue_id, (lat, lon) in found.items()]
+        return [(venue_id, distance)
+                for distance, venue_id in sorted(distances)
+                if distance <= km]
+
+
+venue_locations = GeoGridIndex()
+
+
+def init_venue_grid(app):
+    app.extensions['venue_grid_builder'] = IndexBuilder(
+        app, venue_locations, app.config.get('VENUE_GRID_MAX_AGE', 300),
+        'venue-grid')
+
+
+def rebuild_venue_grid():
+    ''' Starts the background rebuilds of the grid '''
+    builder = current_app.extensions.get('venue_grid_builder')
+    if builder is not None:
+        builder.start()
+
+
+def uses_earthdistance():
+    ''' True on a PostgreSQL database with the earthdistance extension,
+        checked once per engine '''
+    engine = db.engine
+    if engine.dialect.name != 'postgresql':
+        return False
+    if 'earthdistance' not in engine.info:
+        engine.info['earthdistance'] = db.session.execute(text(
+            "SELECT count(*) FROM pg_extension "
+            "WHERE extname = 'earthdistance'")).scalar() > 0
+    return engine.info['earthdistance']
+
+
+VENUE_FIELDS = (Users.id, Users.name, Users.city, Users.state,
+                Venues.latitude, Venues.longitude)
+
+
+def venues_near(latitude, longitude, km, limit):
+    ''' Returns the venues within 'km' of a point, closest first, as rows
+        dicts of VENUE_FIELDS plus distance_km '''
+    if uses_earthdistance():
+        center = db.func.ll_to_earth(latitude, longitude)
+        location = db.func.ll_to_earth(Venues.latitude, Venues.longitude)
+        meters = db.func.earth_distance(center, location)
+        rows = db.session.query(*VENUE_FIELDS,
+                                (meters / 1000).label('distance_km'))\
+            .join(Venues, Venues.user_id == Users.id)\
+            .filter(db.func.earth_box(center, km * 1000).op('@>')(location),
+                    meters <= km * 1000)\
+            .order_by(meters, Users.id).limit(limit)
+        return [dict(row._mapping) for row in rows]
+
+    rebuild_venue_grid()
+    found = venue_locations.near(latitude, longitude, km)[:limit]
+    return with_venue_fields(found)
+
+
+def venues_in_box(south, west, north, east, limit):
+    ''' Returns the venues inside a box, as dicts of VENUE_FIELDS plus
+        their distance_km to the center of the box, closest first '''
+    latitude, longitude = (south + north) / 2, (west + east) / 2
+    inside = (Venues.latitude.between(south, north),
+              Venues.longitude.between(west, east))
+
+    if uses_earthdistance():
+        center = db.func.ll_to_earth(latitude, longitude)
+        location = db.func.ll_to_earth(Venues.latitude, Venues.longitude)
+        meters = db.func.earth_distance(center, location)
+        if east - west <= 180:
+            # up to 180 degrees wide, the point of the box farthest from
+            # its center is a corner: the circle through it holds the
+            # box, and the index can serve its earth_box
+            km = max(distance_km(latitude, longitude, lat, lon)
+                     for lat in (south, north) for lon in (west, east))
+            inside += (db.func.earth_box(center, km * 1000)
+                       .op('@>')(location),)
+        rows = db.session.query(*VENUE_FIELDS,
+                                (meters / 1000).label('distance_km'))\
+            .join(Venues, Venues.user_id == Users.id)\
+            .filter(*inside)\
+            .order_by(meters, Users.id).limit(limit)
+        return [dict(row._mapping) for row in rows]
+
+    rebuild_venue_grid()
+    found = venue_locations.in_box(south, west, north, east)
+    found = sorted((distance_km(latitude, longitude, lat, lon), venue_id)
+                   for venue_id, (lat, lon) in found.items())
+    return with_venue_fields([(venue_id, distance)
+                              for distance, venue_id in found][:limit])
+
+
+def with_venue_fields(found):
+    ''' [(venue_id, distance)] --> dicts of VENUE_FIELDS + distance_km,
+        in the same order, from one query '''
+    distances = dict(found)
+    if not distances:
+        return []
+    rows = db.session.query(*VENUE_FIELDS)\
+        .join(Venues, Venues.user_id == Users.id)\
+        .filter(Users.id.in_(distances)).all()
+    rows = sorted(rows, key=lambda row: (distances[row.id], row.id))
+    return [dict(row._mapping, distance_km=distances[row.id])
+            for row in rows]
+
+
+#  Sets the coordinates of one venue, run as an executemany
+SET_LOCATION = update(Venues)\
+    .where(Venues.user_id == bindparam('venue_id'))\
+    .values(latitude=bindparam('lat'), longitude=bindparam('lon'))\
+    .execution_options(synchronize_session=False)
+
+
+@click.command('geocode-venues')
+@click.option('--all', 'everything', is_flag=True,
+              help='Geocode again the venues that have coordinates.')
+@with_appcontext
+def geocode_command(everything):
+    ''' Sets the venues' coordinates from the gazetteer. '''
+    query = db.session.query(Venues.user_id, Users.city, Users.state)\
+        .join(Users, Users.id == Venues.user_id)
+    if not everything:
+        query = query.filter(Venues.latitude.is_(None))
+
+    located, unknown = [], 0
+    for venue_id, city, state in query.all():
+        place = gazetteer.geocode(city, state)
+        if place is None:
+            unknown += 1
+        else:
+            located.append({'venue_id': venue_id,
+                            'lat': place[0], 'lon': place[1]})
+
+    if located:
+        db.session.execute(SET_LOCATION, located)
+    db.session.commit()
+    click.echo(f'{len(located)} venues geocoded, {unknown} cities not in '
+               f'the gazetteer')
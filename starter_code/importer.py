@@ -0,0 +1,231 @@
+# ----------------------------------------------------------------------------#
+# Bulk import.
+# ----------------------------------------------------------------------------#
+#  flask import artists|venues|shows FILE [--batch-size N] [--resume]
+#
+#  Streams a CSV (with a header row) or JSONL file, validates every row
+#  with the same forms the web pages use, and loads the valid rows in
+#  batches, one transaction per batch.
+#
+#  After each batch the number of rows processed is saved next to the
+#  input file (FILE.checkpoint). If an import fails, running it again
+#  with --resume skips the rows already loaded.
+#
+#  Columns are the form fields. In CSV files the genres are separated
+#  by ';' (Jazz;Blues), in JSONL files they are a list. Example:
+#
+#    name,city,state,phone,genres,facebook_link,website,is_seeking
+#    The Band,Austin,TX,512-555-0100,Jazz;Blues,https://fb.com/x,...
+#
+#  Rejected rows are reported with their line number and the reason,
+#  so they can be fixed and imported again.
+# ----------------------------------------------------------------------------#
+
+import csv
+import json
+import os
+import time
+from itertools import islice
+import click
+from flask.cli import with_appcontext
+from werkzeug.datastructures import MultiDict
+from forms import ArtistForm, VenueForm, ShowForm
+from models import (
+    db,
+    User_genre,
+    Users,
+    Venues,
+    Artists
+)
+from queries import genre_ids
+from scheduling import check_shows, insert_shows
+from geo import locate
+
+
+FORMS = {'artists': ArtistForm,
+         'venues': VenueForm,
+         'shows': ShowForm}
+
+
+def read_rows(path):
+    ''' Yields (line number, row) for every row of a .csv or .jsonl file,
+        the row being a MultiDict of strings, as a web form sends them,
+        or None for a line that is not a JSON object '''
+    with open(path, newline='') as file:
+        if path.endswith('.csv'):
+            reader = csv.DictReader(file)
+            for row in reader:
+                genres = row.pop('genres', None)
+                row = MultiDict(row)
+                if genres:
+                    row.setlist('genres', genres.split(';'))
+                yield reader.line_num, row
+        else:
+            for number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    values = json.loads(line)
+                except ValueError:
+                    values = None
+                if not isinstance(values, dict):
+                    yield number, None
+                    continue
+                # {"artist_id": 1} is read as the form field "1"
+                yield number, MultiDict([
+                    (key, str(item))
+                    for key, value in values.items()
+                    for item in (value if isinstance(value, list)
+                                 else [value])
+                    if item is not None])
+
+
+def batches(rows, size):
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def validate(kind, row):
+    ''' Returns (the bound form, None) if the row is valid, otherwise
+        (None, the reason) '''
+    if row is None:
+        return None, 'not a JSON object'
+    form = FORMS[kind](formdata=row, meta={'csrf': False})
+    if form.validate():
+        return form, None
+    return None, '; '.join(f'{field}: {", ".join(errors)}'
+                           for field, errors in form.errors.items())
+
+
+def load_users(kind, forms):
+    ''' Inserts users with their Venue/Artist row and genres. On
+        PostgreSQL the ORM batches the inserts of each flush. '''
+    users = []
+    for form in forms:
+        user = Users(type='Venue' if kind == 'venues' else 'Artist',
+                     name=form.name.data,
+                     city=form.city.data,
+                     state=form.state.data,
+                     phone=form.phone.data,
+                     image_link=form.image_link.data,
+                     facebook_link=form.facebook_link.data,
+                     website=form.website.data,
+                     is_seeking=form.is_seeking.data == 'Yes',
+                     seeking_description=form.seeking_description.data)
+        if kind == 'venues':
+            user.venue = Venues(address=form.address.data)
+            locate(user.venue, user.city, user.state)
+        else:
+            user.artist = Artists()
+        user.genres = [User_genre(genre_id=id)
+                       for id in genre_ids.get_ids(form.genres.data)]
+        users.append(user)
+
+    db.session.add_all(users)
+    return len(users)
+
+
+def load_shows(forms):
+    ''' Inserts the shows whose artist and venue exist and are free at
+        that time (scheduling.check_shows). 'forms' are (line number,
+        form). Returns the number of shows inserted and the rejected
+        rows, as [(line number, reason)]. '''
+    shows, lines, rejected = [], [], []
+    for line, form in forms:
+        try:
+            shows.append({'artist_id': int(form.artist_id.data),
+                          'venue_id': int(form.venue_id.data),
+                          'start_time': form.start_time.data})
+            lines.append(line)
+        except ValueError:
+            rejected.append((line, 'artist_id and venue_id must be ids'))
+
+    errors = {}
+    for index, message in check_shows(shows):
+        errors.setdefault(index, []).append(message)
+    rejected += [(lines[index], '; '.join(messages))
+                 for index, messages in errors.items()]
+    shows = [show for index, show in enumerate(shows)
+             if index not in errors]
+
+    insert_shows(shows)
+    return len(shows), rejected
+
+
+def read_checkpoint(path):
+    try:
+        with open(path + '.checkpoint') as file:
+            return int(file.read())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def write_checkpoint(path, rows_done):
+    with open(path + '.checkpoint', 'w') as file:
+        file.write(str(rows_done))
+
+
+def import_file(kind, path, batch_size=1000, resume=False, echo=print):
+    '''
+        Imports 'path' and returns (rows loaded, rows rejected).
+        A rejected row is a row that fails validation or, for shows,
+        references an artist or venue that does not exist or double
+        books one. Each of them is echoed with its line number.
+    '''
+    start = read_checkpoint(path) if resume else 0
+    rows = islice(read_rows(path), start, None)
+    if start:
+        echo(f'Resuming after row {start}')
+
+    loaded = rejected = 0
+    started = time.perf_counter()
+
+    for batch in batches(rows, batch_size):
+        forms, invalid = [], []
+        for line, row in batch:
+            form, reason = validate(kind, row)
+            if form is None:
+                invalid.append((line, reason))
+            else:
+                forms.append((line, form))
+        try:
+            if kind == 'shows':
+                inserted, refused = load_shows(forms)
+                invalid += refused
+            else:
+                inserted = load_users(kind, [form for _, form in forms])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            echo(f'Import failed after row {start + loaded + rejected}, '
+                 f'run again with --resume to continue')
+            raise
+
+        for line, reason in sorted(invalid):
+            echo(f'line {line} rejected: {reason}')
+        loaded += inserted
+        rejected += len(batch) - inserted
+        write_checkpoint(path, start + loaded + rejected)
+
+        elapsed = time.perf_counter() - started
+        echo(f'{loaded} rows loaded, {rejected} rejected '
+             f'({loaded / elapsed:.0f} rows/sec)')
+
+    if os.path.exists(path + '.checkpoint'):
+        os.remove(path + '.checkpoint')  # the import is complete
+    return loaded, rejected
+
+
+@click.command('import')
+@click.argument('kind', type=click.Choice(list(FORMS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=1000, show_default=True)
+@click.option('--resume', is_flag=True,
+              help='Skip the rows loaded by a previous, failed run.')
+@with_appcontext
+def import_command(kind, path, batch_size, resume):
+    ''' Bulk loads artists, venues or shows from a CSV or JSONL file. '''
+    import_file(kind, path, batch_size, resume, echo=click.echo)
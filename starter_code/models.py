@@ -13,14 +13,21 @@
 #
 # ----------------------------------------------------------------------------#
 
-from flask_sqlalchemy import SQLAlchemy
+from datetime import timedelta
+from sqlalchemy import DDL, event
+from replicas import RoutingSQLAlchemy
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()  # reads of read-only requests go to the replicas
 
 
 class User_genre(db.Model):
 
     __tablename__ = 'user_genre'
+    __table_args__ = (
+        # The primary key serves lookups by user. This one serves the
+        # genre filters of the advanced search (genre --> users).
+        db.Index('ix_user_genre_genre_id_user_id', 'genre_id', 'user_id'),
+    )
 
     user_id = db.Column(db.Integer,
                         db.ForeignKey('User.id', ondelete='cascade'),
@@ -36,6 +43,13 @@ class User_genre(db.Model):
 
 class Users(db.Model):
     __tablename__ = 'User'
+    __table_args__ = (
+        # Trigram index for the name searches (ILIKE '%term%').
+        # Needs the pg_trgm extension, see the README.
+        db.Index('ix_user_name_trgm', 'name',
+                 postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     type = db.Column(db.String(6), nullable=False)
@@ -73,6 +87,11 @@ class Users(db.Model):
         return f'<ID: {self.id} User Type: {self.type} {self.name}>'
 
 
+event.listen(Users.__table__, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+             .execute_if(dialect='postgresql'))
+
+
 class Genres(db.Model):
     """ The Genres class is used as a reference table only.
     It serves as child table in the many-to-many relationship:
@@ -101,6 +120,14 @@ class Venues(db.Model):
                         db.ForeignKey('User.id', ondelete='cascade'),
                         primary_key=True)
     address = db.Column(db.String(150), nullable=False)
+    # of the venue's city, see geo.py
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    # maintained on write, see counters.py
+    upcoming_shows_count = db.Column(db.Integer, nullable=False,
+                                     default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False,
+                                 default=0, server_default='0')
     shows = db.relationship('Shows',
                             backref=db.backref('venue', lazy='joined'),
                             cascade='all, delete',
@@ -110,12 +137,27 @@ class Venues(db.Model):
         return f'<Venue - User ID: {self.user_id} {self.address}>'
 
 
+event.listen(Venues.__table__, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS cube; '
+                 'CREATE EXTENSION IF NOT EXISTS earthdistance')
+             .execute_if(dialect='postgresql'))
+event.listen(Venues.__table__, 'after_create',
+             DDL('CREATE INDEX IF NOT EXISTS ix_venue_earth ON "Venue" '
+                 'USING gist (ll_to_earth(latitude, longitude))')
+             .execute_if(dialect='postgresql'))
+
+
 class Artists(db.Model):
     __tablename__ = 'Artist'
 
     user_id = db.Column(db.Integer,
                         db.ForeignKey('User.id', ondelete='cascade'),
                         primary_key=True)
+    # maintained on write, see counters.py
+    upcoming_shows_count = db.Column(db.Integer, nullable=False,
+                                     default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False,
+                                 default=0, server_default='0')
     shows = db.relationship('Shows',
                             backref=db.backref('artist', lazy='joined'),
                             cascade='all, delete',
@@ -125,8 +167,20 @@ class Artists(db.Model):
         return f'<Artist - User ID: {self.user_id}>'
 
 
+# A show books its venue and its artist from start_time for SHOW_LENGTH.
+# Two shows of the same venue or artist that overlap are a double
+# booking, see scheduling.py.
+SHOW_LENGTH = timedelta(hours=3)
+
+
 class Shows(db.Model):
     __tablename__ = 'Show'
+    __table_args__ = (
+        # Every past/upcoming split filters the shows of one user by
+        # start_time; these make it an index range scan.
+        db.Index('ix_show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_show_artist_id_start_time', 'artist_id', 'start_time'),
+    )
     id = db.Column(db.Integer, primary_key=True)
 
     artist_id = db.Column(db.Integer,
@@ -136,3 +190,36 @@ class Shows(db.Model):
                          db.ForeignKey('Venue.user_id', ondelete='cascade'),
                          nullable=False)
     start_time = db.Column(db.DateTime, nullable=False)
+
+
+#  On PostgreSQL, exclusion constraints refuse double bookings, including
+#  the ones of concurrent transactions. btree_gist lets the GiST index
+#  compare the user ids with =.
+#  db.create_all() adds them to a new table; on a database created by the
+#  migrations, 'flask check-double-bookings --add-constraints' does
+#  (scheduling.py).
+SHOW_SLOT = f"tsrange(start_time, start_time + " \
+            f"interval '{int(SHOW_LENGTH.total_seconds())} seconds')"
+BOOKING_CONSTRAINTS = {
+    name: f'ALTER TABLE "Show" ADD CONSTRAINT {name} '
+          f'EXCLUDE USING gist ({column} WITH =, {SHOW_SLOT} WITH &&)'
+    for name, column in (('show_venue_not_double_booked', 'venue_id'),
+                         ('show_artist_not_double_booked', 'artist_id'))}
+event.listen(Shows.__table__, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS btree_gist')
+             .execute_if(dialect='postgresql'))
+event.listen(Shows.__table__, 'after_create',
+             DDL('; '.join(BOOKING_CONSTRAINTS.values()))
+             .execute_if(dialect='postgresql'))
+
+
+class Show_counters(db.Model):
+    ''' A single row: the midnight at which the show counters of
+        Venues and Artists split past from upcoming shows '''
+    __tablename__ = 'show_counters'
+
+    id = db.Column(db.Integer, primary_key=True)
+    boundary = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<Show counters - boundary: {self.boundary}>'
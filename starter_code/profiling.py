@@ -0,0 +1,229 @@
+# ----------------------------------------------------------------------------#
+# Profiling.
+# ----------------------------------------------------------------------------#
+#  Opt-in request instrumentation, enabled with PROFILING in config.py.
+#
+#  For every request it records the number of SQL queries, the time
+#  spent in them, the template render time and the slowest statements,
+#  and reports them as:
+#
+#    - a Server-Timing response header (shown by the browser dev tools)
+#    - one JSON log line per request
+#    - per endpoint totals at /_metrics, in Prometheus text format
+#
+#  /_metrics also reports the time spent waiting for a connection of the
+#  pool (TimedQueuePool).
+#
+#  The totals live in the worker process; each worker exposes its own.
+# ----------------------------------------------------------------------------#
+
+import json
+import threading
+import time
+from collections import defaultdict
+from flask import Response, g, has_request_context, request
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+
+class Metrics:
+    ''' Per endpoint totals since the worker started '''
+
+    COUNTERS = [
+        ('requests_total', 'Requests served.'),
+        ('sql_queries_total', 'SQL statements executed.'),
+        ('sql_seconds_total', 'Time spent executing SQL.'),
+        ('template_seconds_total', 'Time spent rendering templates.'),
+        ('request_seconds_total', 'Time spent serving requests.')
+    ]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = defaultdict(lambda: defaultdict(float))
+
+    def add(self, endpoint, **values):
+        with self.lock:
+            for name, value in values.items():
+                self.totals[endpoint][name] += value
+
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            for name, help in self.COUNTERS:
+                lines.append(f'# HELP fyyur_{name} {help}')
+                lines.append(f'# TYPE fyyur_{name} counter')
+                for endpoint, values in sorted(self.totals.items()):
+                    lines.append(f'fyyur_{name}{{endpoint="{endpoint}"}} '
+                                 f'{values[name]:g}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+class PoolStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def add(self, waited):
+        with self.lock:
+            self.checkouts += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def prometheus(self):
+        with self.lock:
+            return '\n'.join([
+                '# HELP fyyur_pool_checkouts_total Connections checked out.',
+                '# TYPE fyyur_pool_checkouts_total counter',
+                f'fyyur_pool_checkouts_total {self.checkouts}',
+                '# HELP fyyur_pool_checkout_wait_seconds_total Time spent '
+                'waiting for a pool connection.',
+                '# TYPE fyyur_pool_checkout_wait_seconds_total counter',
+                f'fyyur_pool_checkout_wait_seconds_total '
+                f'{self.wait_seconds:g}',
+                '# HELP fyyur_pool_checkout_wait_seconds_max Longest wait '
+                'for a pool connection.',
+                '# TYPE fyyur_pool_checkout_wait_seconds_max gauge',
+                f'fyyur_pool_checkout_wait_seconds_max '
+                f'{self.max_wait_seconds:g}'
+            ]) + '\n'
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(QueuePool):
+    ''' QueuePool that measures how long each checkout waits '''
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_stats.add(time.perf_counter() - started)
+
+
+def profiling_request():
+    ''' The stats of the current request, None when not profiling it '''
+    if has_request_context():
+        return g.get('profile')
+    return None
+
+
+def before_cursor_execute(conn, cursor, statement, parameters,
+                          context, executemany):
+    conn.info.setdefault('query_start', []).append(
+        (context, time.perf_counter()))
+
+
+def after_cursor_execute(conn, cursor, statement, parameters,
+                         context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()[1]
+    profile = profiling_request()
+    if profile is None:
+        return
+
+    profile['queries'] += 1
+    profile['sql_time'] += elapsed
+    profile['statements'].append((elapsed, statement))
+
+
+def handle_error(context):
+    ''' A failed statement never reaches after_cursor_execute: drops its
+        start time, or the next statement of the connection would pop it '''
+    starts = context.connection.info.get('query_start') \
+        if context.connection is not None else None
+    if starts and context.execution_context is not None \
+            and starts[-1][0] is context.execution_context:
+        starts.pop()
+
+
+class TimedTemplate(Template):
+    ''' Jinja template that adds its render time to the request stats '''
+
+    def render(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            profile = profiling_request()
+            if profile is not None:
+                profile['template_time'] += time.perf_counter() - started
+
+
+def start_request():
+    g.profile = {'started': time.perf_counter(),
+                 'queries': 0,
+                 'sql_time': 0.0,
+                 'template_time': 0.0,
+                 'statements': []}
+
+
+def init_profiling(app):
+    if not app.config.get('PROFILING'):
+        return
+
+    slowest_count = app.config.get('PROFILING_SLOWEST', 3)
+
+    options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    if 'pool_size' in options:  # a QueuePool, see config.py
+        options.setdefault('poolclass', TimedQueuePool)
+
+    # Listening on the Engine class covers the engine of models.db and
+    # any other engine the app creates.
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(Engine, 'handle_error', handle_error)
+    app.jinja_env.template_class = TimedTemplate
+
+    app.before_request(start_request)
+
+    @app.after_request
+    def report_request(response):
+        profile = profiling_request()
+        if profile is None:
+            return response
+
+        total = time.perf_counter() - profile['started']
+        endpoint = request.endpoint or 'unknown'
+        slowest = sorted(profile['statements'], reverse=True)[:slowest_count]
+
+        response.headers['Server-Timing'] = ', '.join([
+            f'sql;dur={profile["sql_time"] * 1000:.1f};'
+            f'desc="{profile["queries"]} queries"',
+            f'tpl;dur={profile["template_time"] * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}'
+        ])
+
+        app.logger.info(json.dumps({
+            'path': request.path,
+            'endpoint': endpoint,
+            'status': response.status_code,
+            'queries': profile['queries'],
+            'sql_ms': round(profile['sql_time'] * 1000, 1),
+            'template_ms': round(profile['template_time'] * 1000, 1),
+            'total_ms': round(total * 1000, 1),
+            'slowest': [{'ms': round(elapsed * 1000, 1),
+                         'sql': ' '.join(statement.split())}
+                        for elapsed, statement in slowest]
+        }))
+
+        metrics.add(endpoint,
+                    requests_total=1,
+                    sql_queries_total=profile['queries'],
+                    sql_seconds_total=profile['sql_time'],
+                    template_seconds_total=profile['template_time'],
+                    request_seconds_total=total)
+        return response
+
+    @app.route('/_metrics')
+    def prometheus_metrics():
+        return Response(metrics.prometheus() + pool_stats.prometheus(),
+                        mimetype='text/plain; version=0.0.4')
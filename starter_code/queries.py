@@ -0,0 +1,389 @@
+# ----------------------------------------------------------------------------#
+# Queries.
+# ----------------------------------------------------------------------------#
+#  Read helpers shared by the controllers in app.py.
+#
+#  The views used to walk Venues.shows / Artists.shows and run one
+#  Users query per show to get the counterpart's name and image.
+#  The helpers in this module load everything a page needs in a fixed
+#  number of queries, no matter how many shows a user has.
+# ----------------------------------------------------------------------------#
+
+import threading
+from datetime import datetime
+from flask import g
+from sqlalchemy import bindparam, literal, select, tuple_, union_all
+from sqlalchemy.orm import aliased
+from models import (
+    db,
+    User_genre,
+    Users,
+    Genres,
+    Venues,
+    Artists,
+    Shows
+)
+from async_queries import fetch
+
+
+clock = datetime.now  # tests can replace it to freeze the date
+
+
+def todays_datetime():
+    ''' Midnight of the current day, the boundary between past and
+        upcoming shows. Read from the clock once per request (flask.g),
+        so a long running worker never serves a stale boundary '''
+    if 'todays_datetime' not in g:
+        now = clock()
+        g.todays_datetime = datetime(now.year, now.month, now.day)
+    return g.todays_datetime
+
+
+class GenreIdCache:
+    '''
+        In-process map of genre name --> id.
+
+        Genres is a fixed reference table (it mirrors enums.Genres_enum),
+        so the map is loaded once, when the app starts, and genre names
+        are resolved without queries afterwards. invalidate() drops the
+        map if the table ever changes; the next lookup reloads it. A
+        name missing from the map reloads it too, once per lookup: the
+        map may have been loaded before 'flask seed-genres' ran.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.name_to_id = None
+
+    def load(self):
+        name_to_id = dict(db.session.query(Genres.name, Genres.id).all())
+        with self.lock:
+            self.name_to_id = name_to_id
+
+    def invalidate(self):
+        with self.lock:
+            self.name_to_id = None
+
+    def lookup(self, names):
+        name_to_id = self.name_to_id
+        if name_to_id is None or \
+                any(name not in name_to_id for name in names):
+            self.load()
+            name_to_id = self.name_to_id
+        return name_to_id
+
+    def get_ids(self, names):
+        ''' Raises KeyError for a name that is not in the Genres table '''
+        name_to_id = self.lookup(names)
+        return [name_to_id[name] for name in names]
+
+    def known_ids(self, names):
+        ''' get_ids() without the names that are not in the table '''
+        name_to_id = self.lookup(names)
+        return [name_to_id[name] for name in names if name in name_to_id]
+
+
+genre_ids = GenreIdCache()
+
+
+#  Columns a users query can select, by output field name
+USER_COLUMNS = {
+    'id': Users.id,
+    'type': Users.type,
+    'name': Users.name,
+    'city': Users.city,
+    'state': Users.state,
+    'phone': Users.phone,
+    'image_link': Users.image_link,
+    'facebook_link': Users.facebook_link,
+    'website': Users.website,
+    'is_seeking': Users.is_seeking,
+    'seeking_description': Users.seeking_description
+}
+
+
+#  Columns of the profile pages, from the user row
+PROFILE_FIELDS = ('id', 'name', 'city', 'state', 'phone', 'website',
+                  'facebook_link', 'is_seeking', 'seeking_description',
+                  'image_link')
+
+
+#  The statements of the hottest reads are built once, here, with bind
+#  parameters for the values. Building the equivalent Query on every
+#  request costs more Python time than the database spends running it.
+#  A module level statement also computes its cache key cheaply and is
+#  compiled once, then found in the engine's compiled cache on every
+#  execution (benchmarks/compile_cache.py measures the difference).
+#  Under asyncpg the compiled SQL is also a server side prepared
+#  statement, cached per connection.
+
+PROFILE_USER = select(*[USER_COLUMNS[f] for f in PROFILE_FIELDS],
+                      Venues.address)\
+    .outerjoin(Venues, Venues.user_id == Users.id)\
+    .where(Users.id == bindparam('user_id'),
+           Users.type == bindparam('user_type'))
+
+USER_GENRES = select(Genres.name)\
+    .join(User_genre, Genres.id == User_genre.genre_id)\
+    .where(User_genre.user_id == bindparam('user_id'))\
+    .order_by(Genres.name)
+
+
+def user_shows(own_column, other_column):
+    return select(Shows.start_time, Users.id, Users.name, Users.image_link)\
+        .join(Users, Users.id == other_column)\
+        .where(own_column == bindparam('user_id'))\
+        .order_by(Shows.start_time, Shows.id)
+
+
+#  The shows of a user, joined to the counterpart user
+USER_SHOWS = {'Venue': user_shows(Shows.venue_id, Shows.artist_id),
+              'Artist': user_shows(Shows.artist_id, Shows.venue_id)}
+
+
+#  The upcoming shows counters (counters.py) of a set of users
+UPCOMING_SHOWS_COUNTS = union_all(
+    select(Venues.user_id, Venues.upcoming_shows_count)
+    .where(Venues.user_id.in_(bindparam('user_ids', expanding=True))),
+    select(Artists.user_id, Artists.upcoming_shows_count)
+    .where(Artists.user_id.in_(bindparam('user_ids', expanding=True))))
+
+
+def load_profile(user_id, user_type, today):
+    '''
+        Loads the data of the show_venue/show_artist pages in 3 queries:
+
+            1. The user row, outer joined to its Venues row (address)
+            2. The user genres
+            3. Every show of the user, joined to the counterpart user
+               (the artist for a venue, the venue for an artist) so
+               the counterpart's name and image_link come in the same row
+
+        The queries do not depend on each other, in async mode (see
+        async_queries.py) they run concurrently.
+
+        Returns None when no user of the given type exists, otherwise the
+        dict the profile templates expect. The shows are split in
+        past/upcoming using 'today' as the boundary.
+    '''
+    other = 'artist' if user_type == 'Venue' else 'venue'
+
+    users, genres, shows = fetch(PROFILE_USER,
+                                 USER_GENRES,
+                                 USER_SHOWS[user_type],
+                                 params={'user_id': user_id,
+                                         'user_type': user_type})
+    if not users:
+        return None
+
+    user = users[0]
+
+    past_shows = []
+    upcoming_shows = []
+    for start_time, other_id, other_name, other_image_link in shows:
+        show_info = {
+            other + '_id': other_id,
+            other + '_name': other_name,
+            other + '_image_link': other_image_link,
+            'start_time': str(start_time)
+        }
+        if start_time <= today:
+            past_shows.append(show_info)
+        else:
+            upcoming_shows.append(show_info)
+
+    data = {field: user._mapping[field] for field in PROFILE_FIELDS}
+    data.update({
+        "genres": [g[0] for g in genres],
+        "past_shows": past_shows,
+        "upcoming_shows": upcoming_shows,
+        "past_shows_count": len(past_shows),
+        "upcoming_shows_count": len(upcoming_shows)
+    })
+    if user_type == 'Venue':
+        data['address'] = user.address
+
+    return data
+
+
+def count_upcoming_shows(user_ids):
+    '''
+        Returns {user_id: number of upcoming shows} for all 'user_ids',
+        read from the show counters of Venues and Artists in one query.
+    '''
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+
+    counts = db.session.execute(UPCOMING_SHOWS_COUNTS,
+                                {'user_ids': user_ids})
+
+    return dict(counts.all())
+
+
+def show_counterparts(user_id):
+    ''' Returns the (type, id) of every user that shares a show with
+        'user_id', the profiles listing its name and image '''
+    artists = db.session.query(literal('Artist'), Shows.artist_id)\
+        .filter(Shows.venue_id == user_id)
+    venues = db.session.query(literal('Venue'), Shows.venue_id)\
+        .filter(Shows.artist_id == user_id)
+
+    return set(artists.union(venues).all())
+
+
+# Users directory
+# ----------------------------------------------------------------------------#
+
+
+def users_with_genres(genres, match_all):
+    '''
+        Subquery of the ids of the users that play all the genres in
+        'genres' (match_all) or at least one of them. The filtering runs
+        in the database with a HAVING clause, driven by the
+        (genre_id, user_id) index of user_genre. Nobody plays a genre
+        missing from the Genres table.
+    '''
+    matches = db.func.count(db.distinct(User_genre.genre_id))
+
+    return db.session.query(User_genre.user_id)\
+        .filter(User_genre.genre_id.in_(genre_ids.known_ids(genres)))\
+        .group_by(User_genre.user_id)\
+        .having(matches == len(genres) if match_all else matches >= 1)
+
+
+def user_search_filters(city=None, state=None, user_type=None,
+                        genres=(), match_all=True):
+    ''' Filters of the advanced user search, on Users '''
+    filters = []
+    if city:
+        filters.append(Users.city.ilike(f'{city}'))
+    if state:
+        filters.append(Users.state == state)
+    if user_type:
+        filters.append(Users.type == user_type)
+    if genres:
+        # 'all': the user plays every selected genre. 'any': at least one
+        filters.append(Users.id.in_(users_with_genres(genres, match_all)))
+    return filters
+
+
+def page_users(filters, limit, after=None,
+               fields=('name', 'type', 'image_link'), count=False):
+    '''
+        Returns one page of users matching 'filters', ordered by id, and
+        the cursor (last id) of the next page, None on the last page.
+        Only id and the columns in 'fields' are selected.
+
+        With 'count', the number of users matching 'filters' comes third,
+        as in page_shows().
+    '''
+    fields = ['id'] + [f for f in fields if f != 'id']
+    query = db.session.query(*[USER_COLUMNS[f] for f in fields])\
+        .filter(*filters)
+    if after:
+        query = query.filter(Users.id > after)
+
+    queries = [query.order_by(Users.id).limit(limit + 1)]
+    if count:
+        queries.append(db.session.query(db.func.count(Users.id))
+                       .filter(*filters))
+    results = fetch(*[query.statement for query in queries])
+
+    rows = results[0]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].id
+
+    if count:
+        return rows, next_cursor, results[1][0][0]
+    return rows, next_cursor
+
+
+# Shows listing
+# ----------------------------------------------------------------------------#
+
+#  A show points to two users (through Artists and Venues, which share
+#  the users' primary key). Aliasing Users twice gives both names in a
+#  single joined row.
+Artist_user = aliased(Users, name='artist_user')
+Venue_user = aliased(Users, name='venue_user')
+
+
+#  Columns a shows query can select, by output field name
+SHOW_COLUMNS = {
+    'id': Shows.id,
+    'start_time': Shows.start_time,
+    'artist_id': Shows.artist_id,
+    'artist_name': Artist_user.name.label('artist_name'),
+    'artist_image_link': Artist_user.image_link.label('artist_image_link'),
+    'venue_id': Shows.venue_id,
+    'venue_name': Venue_user.name.label('venue_name'),
+    'venue_image_link': Venue_user.image_link.label('venue_image_link')
+}
+
+SHOW_FIELDS = ('artist_id', 'artist_name', 'artist_image_link',
+               'venue_id', 'venue_name')
+
+
+def shows_query(fields=SHOW_FIELDS):
+    ''' Selects id, start_time (the pagination keys) and 'fields' '''
+    fields = ['id', 'start_time'] + \
+        [f for f in fields if f not in ('id', 'start_time')]
+
+    return db.session.query(*[SHOW_COLUMNS[f] for f in fields])\
+        .join(Artist_user, Artist_user.id == Shows.artist_id)\
+        .join(Venue_user, Venue_user.id == Shows.venue_id)
+
+
+def encode_cursor(row):
+    return f'{row.start_time.isoformat()}_{row.id}'
+
+
+def decode_cursor(cursor):
+    ''' Raises ValueError on a malformed cursor '''
+    start_time, show_id = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(start_time), int(show_id)
+
+
+def page_shows(filters, limit, after=None, fields=SHOW_FIELDS, count=False):
+    '''
+        Returns one page of shows matching 'filters' ordered by
+        (start_time, id), plus the cursor of the next page (None on the
+        last page). The page starts right after the 'after' cursor, so
+        deep pages cost the same as the first one.
+
+        With 'count', the number of shows matching 'filters' comes third;
+        in async mode it is counted while the page is read.
+    '''
+    query = shows_query(fields).filter(*filters)
+    if after:
+        query = query.filter(
+            tuple_(Shows.start_time, Shows.id) > decode_cursor(after))
+
+    queries = [query.order_by(Shows.start_time, Shows.id).limit(limit + 1)]
+    if count:
+        queries.append(count_shows_query(filters))
+    results = fetch(*[query.statement for query in queries])
+
+    rows = results[0]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1])
+
+    if count:
+        return rows, next_cursor, results[1][0][0]
+    return rows, next_cursor
+
+
+def count_shows_query(filters):
+    return db.session.query(db.func.count(Shows.id))\
+        .join(Artist_user, Artist_user.id == Shows.artist_id)\
+        .join(Venue_user, Venue_user.id == Shows.venue_id)\
+        .filter(*filters)
+
+
+def count_shows(filters):
+    return count_shows_query(filters).scalar()
@@ -0,0 +1,189 @@
+# ----------------------------------------------------------------------------#
+# Replicas.
+# ----------------------------------------------------------------------------#
+#  Sends the reads of read-only requests to the read replicas listed in
+#  SQLALCHEMY_REPLICA_URIS (config.py), and everything else to the
+#  primary.
+#
+#  - GET/HEAD requests, and the views marked with @replica_reads (the
+#    POST searches), are read-only. Each one reads from a single replica,
+#    picked round-robin among the healthy ones; when none is healthy it
+#    reads from the primary.
+#  - A replica is checked every REPLICA_CHECK_INTERVAL seconds, and is
+#    skipped while it is down or more than REPLICA_MAX_LAG seconds behind.
+#  - Flushes and INSERT/UPDATE/DELETE statements always go to the primary.
+#    Once a request has written, the rest of it reads from the primary,
+#    and so does the client for READ_YOUR_WRITES_SECONDS (a cookie), so
+#    the page it is redirected to shows its own writes.
+#
+#  Without replicas configured the session always uses the primary.
+# ----------------------------------------------------------------------------#
+
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm, text
+from sqlalchemy.exc import SQLAlchemyError
+
+COOKIE = 'read_primary_until'
+
+# 0 when the replica has replayed everything it received, otherwise the
+# age of the last transaction replayed. NULL on a server that is not a
+# standby (a primary listed as a replica in development).
+LAG_QUERY = text(
+    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() '
+    'THEN 0 '
+    'ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END')
+
+
+class ReplicaRouter:
+    ''' Round-robin over the replica binds, skipping the unhealthy ones '''
+
+    def __init__(self, app, bind_keys):
+        self.app = app
+        self.bind_keys = bind_keys
+        self.check_interval = app.config.get('REPLICA_CHECK_INTERVAL', 10)
+        self.max_lag = app.config.get('REPLICA_MAX_LAG', 5)
+        self.lock = threading.Lock()
+        self.turn = itertools.count()
+        self.status = {}  # bind key --> (healthy, checked at)
+
+    def engine(self, bind_key):
+        db = self.app.extensions['sqlalchemy'].db
+        return db.get_engine(self.app, bind=bind_key)
+
+    def pick(self):
+        ''' The engine of the next healthy replica, None if there is none '''
+        start = next(self.turn)
+        for i in range(len(self.bind_keys)):
+            bind_key = self.bind_keys[(start + i) % len(self.bind_keys)]
+            if self.is_healthy(bind_key):
+                return self.engine(bind_key)
+        return None
+
+    def is_healthy(self, bind_key):
+        now = time.monotonic()
+        with self.lock:
+            healthy, checked_at = self.status.get(bind_key, (True, None))
+            if checked_at is not None and \
+                    now - checked_at < self.check_interval:
+                return healthy
+            # the other threads keep the last result meanwhile
+            self.status[bind_key] = (healthy, now)
+
+        healthy = self.check(bind_key)
+        with self.lock:
+            self.status[bind_key] = (healthy, now)
+        return healthy
+
+    def check(self, bind_key):
+        engine = self.engine(bind_key)
+        try:
+            with engine.connect() as connection:
+                if engine.dialect.name != 'postgresql':
+                    connection.execute(text('SELECT 1'))
+                    return True
+                lag = connection.execute(LAG_QUERY).scalar()
+        except SQLAlchemyError as error:
+            self.app.logger.warning(f'replica {bind_key} is down: {error}')
+            return False
+
+        if lag is not None and lag > self.max_lag:
+            self.app.logger.warning(f'replica {bind_key} is {lag:.0f}s '
+                                    'behind, skipped')
+            return False
+        return True
+
+
+def wrote():
+    ''' Called on every write: the request moves to the primary '''
+    if has_request_context():
+        g.wrote = True
+        g.read_only = False
+
+
+def read_replica(app):
+    ''' The replica engine of the current request, None for the primary '''
+    router = app.extensions.get('replicas')
+    if router is None or not has_request_context() or \
+            not g.get('read_only'):
+        return None
+    if 'replica' not in g:  # the same replica for the whole request
+        g.replica = router.pick()
+    return g.replica
+
+
+@contextmanager
+def primary():
+    ''' Reads inside the block go to the primary '''
+    if not has_request_context():
+        yield
+        return
+    read_only = g.get('read_only', False)
+    g.read_only = False
+    try:
+        yield
+    finally:
+        g.read_only = read_only and not g.get('wrote', False)
+
+
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._flushing or getattr(clause, 'is_dml', False):
+            wrote()
+        else:
+            replica = read_replica(self.app)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    ''' SQLAlchemy whose session routes the reads with read_replica() '''
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def replica_reads(view):
+    ''' Marks a POST view that only reads, so it can use the replicas '''
+    view.replica_reads = True
+    return view
+
+
+def init_replicas(app):
+    uris = app.config.get('SQLALCHEMY_REPLICA_URIS') or []
+    if not uris:
+        return
+
+    # Flask-SQLAlchemy creates the engines of the binds, with the same
+    # SQLALCHEMY_ENGINE_OPTIONS as the primary. No model uses them.
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    bind_keys = []
+    for i, uri in enumerate(uris):
+        bind_keys.append(f'replica_{i}')
+        binds[f'replica_{i}'] = uri
+    app.config['SQLALCHEMY_BINDS'] = binds
+    app.extensions['replicas'] = ReplicaRouter(app, bind_keys)
+
+    read_your_writes = app.config.get('READ_YOUR_WRITES_SECONDS', 10)
+
+    @app.before_request
+    def route_request():
+        view = app.view_functions.get(request.endpoint)
+        wrote_recently = \
+            request.cookies.get(COOKIE, 0, type=float) > time.time()
+        g.read_only = not wrote_recently and \
+            (request.method in ('GET', 'HEAD') or
+             getattr(view, 'replica_reads', False))
+
+    @app.after_request
+    def stick_to_primary(response):
+        if g.get('wrote'):
+            response.set_cookie(COOKIE, str(time.time() + read_your_writes),
+                                max_age=read_your_writes, httponly=True)
+        return response
@@ -0,0 +1,215 @@
+# ----------------------------------------------------------------------------#
+# Show scheduling.
+# ----------------------------------------------------------------------------#
+#  schedule_shows() books a batch of shows, all or none, in the caller's
+#  transaction. POST /api/v1/shows takes festival line ups of thousands
+#  of slots; the show form and flask import go through it too.
+#
+#  A batch is checked with a fixed number of queries, whatever its size:
+#
+#    - one query reads which of its artist and venue ids exist
+#    - one query reads the shows already booked for its artists and
+#      venues around its time span (the (venue_id, start_time) and
+#      (artist_id, start_time) indexes)
+#    - a sorted sweep over the slots of each artist and venue, in
+#      Python, finds the double bookings, in the batch and against the
+#      booked shows
+#
+#  On PostgreSQL the exclusion constraints of models.py back the sweep:
+#  a show booked by a concurrent transaction between the check and the
+#  insert makes the insert fail with an IntegrityError. db.create_all()
+#  adds them; on a database created by the migrations, run
+#
+#    flask check-double-bookings --add-constraints
+#
+#  which lists the shows already double booked (the constraints cannot
+#  be added until they are moved) and adds the constraints otherwise.
+# ----------------------------------------------------------------------------#
+
+from collections import defaultdict
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, literal, or_, select, text, union_all
+from models import (
+    db,
+    Venues,
+    Artists,
+    Shows,
+    SHOW_LENGTH,
+    BOOKING_CONSTRAINTS
+)
+from counters import count_new_shows
+from show_calendar import calendar_changed
+
+#  The artists and venues among 'user_ids', with their type
+EXISTING_USERS = union_all(
+    select(Artists.user_id, literal('artist_id'))
+    .where(Artists.user_id.in_(bindparam('user_ids', expanding=True))),
+    select(Venues.user_id, literal('venue_id'))
+    .where(Venues.user_id.in_(bindparam('user_ids', expanding=True))))
+
+
+def missing_users(shows):
+    ''' Returns {(column, user id)} of the artists and venues of 'shows'
+        that do not exist '''
+    wanted = {(column, show[column])
+              for show in shows for column in ('artist_id', 'venue_id')}
+    found = db.session.execute(
+        EXISTING_USERS,
+        {'user_ids': list({user_id for _, user_id in wanted})}).all()
+    return wanted - {(column, user_id) for user_id, column in found}
+
+
+def booked_shows(shows):
+    ''' The shows in the database that could overlap with 'shows': those
+        of the same artists and venues, in their time span '''
+    first = min(show['start_time'] for show in shows) - SHOW_LENGTH
+    last = max(show['start_time'] for show in shows) + SHOW_LENGTH
+    artist_ids = list({show['artist_id'] for show in shows})
+    venue_ids = list({show['venue_id'] for show in shows})
+
+    return db.session.query(Shows.id, Shows.artist_id, Shows.venue_id,
+                            Shows.start_time)\
+        .filter(or_(Shows.artist_id.in_(artist_ids),
+                    Shows.venue_id.in_(venue_ids)),
+                Shows.start_time > first,
+                Shows.start_time < last).all()
+
+
+def double_bookings(shows, booked):
+    '''
+        Sorted interval sweep. Returns [(index of a show in 'shows',
+        column, the show it overlaps with)], the show it overlaps with
+        being the index of another show in 'shows' or a 'booked' row.
+    '''
+    slots = defaultdict(list)  # (column, user id) --> [(start, owner)]
+    for index, show in enumerate(shows):
+        for column in ('artist_id', 'venue_id'):
+            slots[(column, show[column])].append(
+                (show['start_time'], index))
+    for show in booked:
+        for column in ('artist_id', 'venue_id'):
+            key = (column, getattr(show, column))
+            if key in slots:  # only the ones the batch competes with
+                slots[key].append((show.start_time, show))
+
+    conflicts = []
+    for (column, _), user_slots in slots.items():
+        # every show lasts SHOW_LENGTH, so the latest start seen so far
+        # holds the end that reaches furthest
+        user_slots.sort(key=lambda slot: slot[0])
+        previous = None
+        for start, owner in user_slots:
+            if previous and start < previous[0] + SHOW_LENGTH:
+                if isinstance(owner, int):
+                    conflicts.append((owner, column, previous[1]))
+                elif isinstance(previous[1], int):
+                    conflicts.append((previous[1], column, owner))
+            previous = (start, owner)
+    return conflicts
+
+
+def check_shows(shows):
+    ''' Returns the errors of 'shows' (dicts with artist_id, venue_id and
+        start_time) as [(index of the show, message)], empty if they can
+        all be booked '''
+    if not shows:
+        return []
+
+    missing = missing_users(shows)
+    errors = [(index, f'{column[:-3]} {show[column]} does not exist')
+              for index, show in enumerate(shows)
+              for column in ('artist_id', 'venue_id')
+              if (column, show[column]) in missing]
+
+    # the shows that will not be booked anyway cannot double book others
+    rejected = {index for index, _ in errors}
+    valid = [index for index in range(len(shows)) if index not in rejected]
+    valid_shows = [shows[index] for index in valid]
+    if valid_shows:
+        reported = set()  # one error per show and column
+        for index, column, other in double_bookings(
+                valid_shows, booked_shows(valid_shows)):
+            if (index, column) in reported:
+                continue
+            reported.add((index, column))
+            other = f'show {valid[other]}' if isinstance(other, int) \
+                else f'booked show {other.id}'
+            errors.append((valid[index],
+                           f'{column[:-3]} {valid_shows[index][column]} is '
+                           f'already booked at that time ({other})'))
+    return sorted(errors)
+
+
+def insert_shows(shows):
+    ''' Inserts checked shows, with a single executemany, and adds them
+        to the show counters and the calendar '''
+    if not shows:
+        return
+    db.session.execute(Shows.__table__.insert(), shows)
+    count_new_shows(shows)
+    calendar_changed({show['venue_id'] for show in shows},
+                     min(show['start_time'] for show in shows),
+                     max(show['start_time'] for show in shows))
+
+
+def schedule_shows(shows):
+    ''' Inserts 'shows' if none of them has an error. Returns the errors,
+        as check_shows(). The caller commits. '''
+    errors = check_shows(shows)
+    if not errors:
+        insert_shows(shows)
+    return errors
+
+
+def booked_twice():
+    ''' Yields (column, user id, show id, show id) for every pair of
+        consecutive overlapping shows of a venue or an artist already in
+        the database, reading the shows in index order '''
+    for column in ('venue_id', 'artist_id'):
+        user_column = getattr(Shows, column)
+        rows = db.session.query(user_column, Shows.id, Shows.start_time)\
+            .order_by(user_column, Shows.start_time, Shows.id)\
+            .yield_per(10000)
+        previous = None
+        for user_id, show_id, start_time in rows:
+            if previous and previous[0] == user_id and \
+                    start_time < previous[2] + SHOW_LENGTH:
+                yield column, user_id, previous[1], show_id
+            previous = (user_id, show_id, start_time)
+
+
+def missing_constraints():
+    return [name for name in BOOKING_CONSTRAINTS
+            if not db.session.execute(
+                text('SELECT 1 FROM pg_constraint WHERE conname = :name'),
+                {'name': name}).first()]
+
+
+@click.command('check-double-bookings')
+@click.option('--add-constraints', is_flag=True,
+              help='Add the PostgreSQL exclusion constraints if no show '
+                   'is double booked.')
+@with_appcontext
+def check_command(add_constraints):
+    ''' Lists the shows that double book a venue or an artist. '''
+    found = 0
+    for column, user_id, show_id, other_id in booked_twice():
+        click.echo(f'{column[:-3]} {user_id}: shows {show_id} and '
+                   f'{other_id} overlap')
+        found += 1
+    click.echo(f'{found} double bookings')
+
+    if not add_constraints:
+        return
+    if db.engine.dialect.name != 'postgresql':
+        raise click.ClickException('the constraints are PostgreSQL only')
+    if found:
+        raise click.ClickException('move or delete the double booked shows '
+                                   'before adding the constraints')
+    db.session.execute(text('CREATE EXTENSION IF NOT EXISTS btree_gist'))
+    missing = missing_constraints()
+    for name in missing:
+        db.session.execute(text(BOOKING_CONSTRAINTS[name]))
+    db.session.commit()
+    click.echo(f'{len(missing)} constraints added')
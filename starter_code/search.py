@@ -0,0 +1,204 @@
+# ----------------------------------------------------------------------------#
+# Search.
+# ----------------------------------------------------------------------------#
+#  Name search for artists and venues.
+#
+#  On PostgreSQL the search runs on the GIN trigram index of "User".name
+#  (see models.py), which serves ILIKE '%term%' without a sequential
+#  scan, and ranks results with pg_trgm's word_similarity().
+#
+#  Other databases (SQLite in development) fall back to NgramIndex, an
+#  in-process trigram index with the same matching rules and a similar
+#  ranking.
+#  It is built from the database on first use and kept up to date by the
+#  write paths in app.py (add/update/delete user). The users added by
+#  other workers and by flask import are picked up when it is rebuilt in
+#  the background, every USER_INDEX_MAX_AGE seconds
+#  (bitmaps.IndexBuilder).
+# ----------------------------------------------------------------------------#
+
+import threading
+import time
+from collections import defaultdict
+from flask import current_app
+from models import db, Users
+from bitmaps import IndexBuilder
+
+
+def trigrams(text):
+    ''' Trigrams of a lower cased, space padded string, like pg_trgm '''
+    grams = set()
+    for word in text.lower().split():
+        padded = f'  {word} '
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+def similarity(a, b):
+    ''' Jaccard similarity of two trigram sets, as pg_trgm similarity() '''
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class NgramIndex:
+    '''
+        Trigram inverted index of the users' names:
+
+            trigram --> set of user ids
+
+        A search intersects the postings of the term's trigrams to get
+        the candidates, keeps those whose name contains the term (same
+        result as ILIKE '%term%') and ranks them by similarity.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()  # one build at a time
+        self.journal = None  # the writes made during a build
+        self.built_at = None
+        self.postings = defaultdict(set)
+        self.users = {}  # user_id --> (type, name, trigrams)
+
+    def build(self):
+        with self.build_lock:
+            self._build()
+
+    def build_once(self):
+        ''' Builds the index on first use '''
+        with self.build_lock:
+            if self.built_at is None:
+                self._build()
+
+    def _build(self):
+        with self.lock:
+            self.journal = []
+        try:
+            users = db.session.query(Users.id, Users.type, Users.name).all()
+        except Exception:
+            with self.lock:
+                self.journal = None
+            raise
+
+        with self.lock:
+            self.postings.clear()
+            self.users.clear()
+            for user in users:
+                self._add(*user)
+            # the writes made since the query, as bitmaps.BitmapIndex
+            for user_id, user in self.journal:
+                self._remove(user_id)
+                if user is not None:
+                    self._add(user_id, *user)
+            self.journal = None
+            self.built_at = time.time()
+
+    def _add(self, user_id, user_type, name):
+        grams = trigrams(name)
+        self.users[user_id] = (user_type, name, grams)
+        for gram in grams:
+            self.postings[gram].add(user_id)
+
+    def _remove(self, user_id):
+        user = self.users.pop(user_id, None)
+        if user is None:
+            return
+        for gram in user[2]:
+            self.postings[gram].discard(user_id)
+            if not self.postings[gram]:
+                del self.postings[gram]
+
+    def add(self, user_id, user_type, name):
+        ''' Adds a user, replacing its previous entry if any '''
+        with self.lock:
+            if self.journal is not None:
+                self.journal.append((user_id, (user_type, name)))
+            if self.built_at is not None:  # else the build picks it up
+                self._remove(user_id)
+                self._add(user_id, user_type, name)
+
+    def remove(self, user_id):
+        with self.lock:
+            if self.journal is not None:
+                self.journal.append((user_id, None))
+            if self.built_at is not None:
+                self._remove(user_id)
+
+    def search(self, term, user_type):
+        ''' Returns [(user_id, name)] sorted by relevance '''
+        if self.built_at is None:
+            self.build_once()
+
+        term = term.lower().strip()
+        term_grams = trigrams(term)
+        with self.lock:
+            # the term can start or end in the middle of a word, so
+            # only the unpadded trigrams can discard candidates
+            filtering = [g for g in term_grams if ' ' not in g]
+            if term and filtering:
+                postings = [self.postings.get(g, set()) for g in filtering]
+                candidates = set.intersection(*postings)
+            else:
+                candidates = self.users.keys()
+
+            matches = []
+            for user_id in candidates:
+                type, name, grams = self.users[user_id]
+                if type == user_type and term in name.lower():
+                    rank = similarity(term_grams, grams)
+                    matches.append((-rank, user_id, name))
+
+        matches.sort()
+        return [(user_id, name) for _, user_id, name in matches]
+
+
+user_index = NgramIndex()
+
+
+def init_user_index(app):
+    app.extensions['user_index_builder'] = IndexBuilder(
+        app, user_index, app.config.get('USER_INDEX_MAX_AGE', 300),
+        'user-index')
+
+
+def rebuild_user_index():
+    ''' Starts the background rebuilds of the index '''
+    builder = current_app.extensions.get('user_index_builder')
+    if builder is not None:
+        builder.start()
+
+
+def uses_trigram_index():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def search_users(term, user_type, page, per_page):
+    '''
+        Returns one page of the users of 'user_type' whose name contains
+        'term', best matches first:
+
+            {"total": number of matches, "results": [(id, name), ...]}
+    '''
+    offset = (page - 1) * per_page
+
+    if not uses_trigram_index():
+        rebuild_user_index()
+        matches = user_index.search(term, user_type)
+        return {"total": len(matches),
+                "results": matches[offset:offset + per_page]}
+
+    rank = db.func.word_similarity(term, Users.name)
+    rows = db.session.query(Users.id,
+                            Users.name,
+                            db.func.count().over().label('total'))\
+        .filter(Users.name.ilike(f'%{term}%'), Users.type == user_type)\
+        .order_by(rank.desc(), Users.id)\
+        .offset(offset).limit(per_page).all()
+
+    # the window count comes with every row, so the total needs no
+    # second scan. A page past the end has no rows to carry it.
+    total = rows[0].total if rows else 0
+
+    return {"total": total,
+            "results": [(row.id, row.name) for row in rows]}
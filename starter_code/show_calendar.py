@@ -0,0 +1,246 @@
+# ----------------------------------------------------------------------------#
+# Show calendar.
+# ----------------------------------------------------------------------------#
+#  "What's on in Austin, TX this week": show_calendar holds one row per
+#  show with what a listing needs (the venue's city and state, the ISO
+#  week of the show, both names, the artist's genres), indexed by
+#  (state, city, week, start_time). A calendar page reads its rows with
+#  one index range scan, whatever the size of "Show".
+#
+#  On PostgreSQL show_calendar is a materialized view. A write schedules
+#  a REFRESH ... CONCURRENTLY, run at most every CALENDAR_REFRESH_SECONDS
+#  by a background thread; reads never wait for it.
+#
+#  Other databases (SQLite in development) get a summary table with the
+#  same columns, which the writes update in their own transaction: the
+#  rows of the users and time span they touched are deleted and selected
+#  again.
+#
+#  Both are created by db.create_all() and by
+#
+#    flask refresh-calendar
+#
+#  which also fills them again. Alembic migrations do not create them:
+#  run it after 'flask db upgrade', and after a bulk load.
+# ----------------------------------------------------------------------------#
+
+import threading
+from datetime import date, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import (
+    Date,
+    DateTime,
+    Integer,
+    String,
+    and_,
+    cast,
+    column,
+    delete,
+    event,
+    insert,
+    or_,
+    select,
+    table,
+    text
+)
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from models import db, User_genre, Genres, Shows
+from queries import Artist_user, Venue_user, decode_cursor, encode_cursor
+
+CALENDAR = table(
+    'show_calendar',
+    column('id', Integer),  # of the show
+    column('start_time', DateTime),
+    column('week', Date),  # the monday of the ISO week of start_time
+    column('city', String),
+    column('state', String),
+    column('venue_id', Integer),
+    column('venue_name', String),
+    column('artist_id', Integer),
+    column('artist_name', String),
+    column('artist_image_link', String),
+    column('genres', String)  # of the artist, comma separated
+)
+
+
+def calendar_select(dialect):
+    ''' The rows of show_calendar, in the SQL of 'dialect' '''
+    if dialect == 'postgresql':
+        week = cast(db.func.date_trunc('week', Shows.start_time), Date)
+        genres = db.func.string_agg(Genres.name,
+                                    aggregate_order_by(', ', Genres.name))
+    else:
+        # the next sunday (or the same day), 6 days back
+        week = db.func.date(Shows.start_time, 'weekday 0', '-6 days')
+        genres = db.func.group_concat(Genres.name, ', ')
+
+    artist_genres = select(genres)\
+        .join(User_genre, User_genre.genre_id == Genres.id)\
+        .where(User_genre.user_id == Shows.artist_id)\
+        .scalar_subquery()
+
+    return select(Shows.id,
+                  Shows.start_time,
+                  week.label('week'),
+                  Venue_user.city,
+                  Venue_user.state,
+                  Shows.venue_id,
+                  Venue_user.name.label('venue_name'),
+                  Shows.artist_id,
+                  Artist_user.name.label('artist_name'),
+                  Artist_user.image_link.label('artist_image_link'),
+                  artist_genres.label('genres'))\
+        .join(Venue_user, Venue_user.id == Shows.venue_id)\
+        .join(Artist_user, Artist_user.id == Shows.artist_id)
+
+
+def create_calendar(target, connection, **kw):
+    dialect = connection.dialect
+    query = calendar_select(dialect.name)\
+        .compile(dialect=dialect, compile_kwargs={'literal_binds': True})
+    relation = 'MATERIALIZED VIEW' if dialect.name == 'postgresql' \
+        else 'TABLE'
+
+    connection.execute(text(
+        f'CREATE {relation} IF NOT EXISTS show_calendar AS {query}'))
+    # the unique index lets PostgreSQL refresh the view concurrently
+    connection.execute(text(
+        'CREATE UNIQUE INDEX IF NOT EXISTS ix_show_calendar_id '
+        'ON show_calendar (id)'))
+    connection.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_show_calendar_place_week '
+        'ON show_calendar (state, city, week, start_time)'))
+
+
+def drop_calendar(target, connection, **kw):
+    relation = 'MATERIALIZED VIEW' \
+        if connection.dialect.name == 'postgresql' else 'TABLE'
+    connection.execute(text(f'DROP {relation} IF EXISTS show_calendar'))
+
+
+event.listen(db.metadata, 'after_create', create_calendar)
+event.listen(db.metadata, 'before_drop', drop_calendar)
+
+
+class CalendarRefresher:
+    ''' Refreshes the materialized view in a background thread, at most
+        every 'interval' seconds '''
+
+    def __init__(self, app, interval):
+        self.app = app
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def changed(self):
+        with self.lock:
+            if self.timer is None:  # else the pending refresh covers it
+                self.timer = threading.Timer(self.interval, self.refresh)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def refresh(self):
+        with self.lock:
+            self.timer = None
+        with self.app.app_context():
+            try:
+                refresh_calendar()
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                self.app.logger.exception('show calendar refresh failed')
+
+
+def init_calendar(app):
+    app.extensions['calendar_refresher'] = CalendarRefresher(
+        app, app.config.get('CALENDAR_REFRESH_SECONDS', 30))
+
+
+def is_materialized():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def refresh_calendar():
+    ''' Creates the calendar if it is missing and rebuilds it. The caller
+        commits. '''
+    create_calendar(db.metadata, db.session.connection())
+    if is_materialized():
+        db.session.execute(text(
+            'REFRESH MATERIALIZED VIEW CONCURRENTLY show_calendar'))
+    else:
+        db.session.execute(delete(CALENDAR))
+        db.session.execute(insert(CALENDAR).from_select(
+            CALENDAR.c.keys(), calendar_select(db.engine.dialect.name)))
+
+
+def calendar_changed(user_ids, first=None, last=None):
+    '''
+        Called in the transaction of a write that changed the shows of
+        'user_ids' (artists or venues), or what the calendar shows of
+        them. 'first' and 'last' narrow it to the shows starting in that
+        span, for new shows.
+    '''
+    if is_materialized():
+        current_app.extensions['calendar_refresher'].changed()
+        return
+
+    user_ids = list(user_ids)
+    db.session.flush()  # the rows are selected again from the changes
+
+    def rows(table):
+        condition = or_(table.c.venue_id.in_(user_ids),
+                        table.c.artist_id.in_(user_ids))
+        if first is not None:
+            condition = and_(condition,
+                             table.c.start_time.between(first, last))
+        return condition
+
+    query = calendar_select(db.engine.dialect.name).subquery()
+    db.session.execute(delete(CALENDAR).where(rows(CALENDAR)))
+    db.session.execute(insert(CALENDAR).from_select(
+        CALENDAR.c.keys(), select(query).where(rows(query))))
+
+
+def parse_week(value, today):
+    ''' The monday of an ISO week given as '2031-W23' (the value of an
+        <input type="week">), of the week of 'today' if empty. Raises
+        ValueError on a malformed week. '''
+    if not value:
+        return today.date() - timedelta(days=today.weekday())
+    year, week = value.split('-W')
+    return date.fromisocalendar(int(year), int(week), 1)
+
+
+def calendar(city, state, week, limit, after=None):
+    '''
+        Returns the shows of (city, state) in the ISO week starting on
+        'week' (a monday), by start time, and the cursor of the next page
+        (None on the last page). Raises ValueError on a malformed cursor.
+    '''
+    query = select(CALENDAR)\
+        .where(CALENDAR.c.state == state,
+               CALENDAR.c.city == city,
+               CALENDAR.c.week == week)
+    if after:
+        start_time, show_id = decode_cursor(after)
+        query = query.where(or_(CALENDAR.c.start_time > start_time,
+                                and_(CALENDAR.c.start_time == start_time,
+                                     CALENDAR.c.id > show_id)))
+
+    rows = db.session.execute(
+        query.order_by(CALENDAR.c.start_time, CALENDAR.c.id)
+        .limit(limit + 1)).all()
+    next_cursor = encode_cursor(rows[limit - 1]) \
+        if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+@click.command('refresh-calendar')
+@with_appcontext
+def refresh_command():
+    ''' Creates or rebuilds the show calendar. '''
+    refresh_calendar()
+    db.session.commit()
+    click.echo('show calendar refreshed')
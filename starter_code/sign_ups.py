@@ -0,0 +1,84 @@
+# ----------------------------------------------------------------------------#
+# Latest sign ups.
+# ----------------------------------------------------------------------------#
+#  The home page lists the latest users to sign up. The list is kept in
+#  a cache backend (cache.py), so the page renders without a query:
+#
+#    - it is loaded when the app starts (warm_caches) and reloaded when
+#      older than LATEST_SIGN_UPS_MAX_AGE seconds, which picks up the
+#      users added by other workers and by flask import
+#    - add_data_from_form, update_user and delete_user update it
+#
+#  With PROFILE_CACHE_REDIS_URL set, the list lives in Redis and all the
+#  workers share it; otherwise each worker keeps its own. The changes
+#  are read-modify-writes, made atomic by the backend's update().
+# ----------------------------------------------------------------------------#
+
+import time
+from flask import current_app
+from models import db, Users
+from cache import make_cache
+from replicas import primary
+
+KEY = 'sign_ups:latest'
+FIELDS = ('id', 'type', 'name', 'image_link')
+
+
+class SignUpFeed:
+
+    def __init__(self, cache, size, max_age):
+        self.cache = cache
+        self.size = size
+        self.max_age = max_age
+
+    def load(self):
+        ''' Reads the latest sign ups from the database (one query) '''
+        with primary():  # a lagging replica could drop a new user
+            rows = db.session.query(*[getattr(Users, f) for f in FIELDS])\
+                .order_by(db.desc(Users.id)).limit(self.size).all()
+
+        users = [dict(zip(FIELDS, row)) for row in rows]
+        self.cache.set(KEY, {'loaded_at': time.time(), 'users': users})
+        return users
+
+    def get(self):
+        ''' The latest sign ups, newest first, as dicts of FIELDS '''
+        feed = self.cache.get(KEY)
+        if feed is None or time.time() - feed['loaded_at'] > self.max_age:
+            return self.load()
+        return feed['users']
+
+    def update(self, change):
+        ''' Replaces the cached list by change(list) '''
+        self.cache.update(
+            KEY, lambda feed: dict(feed, users=change(feed['users'])))
+
+    def add(self, user):
+        ''' 'user' is a dict of FIELDS. A reload since the commit may
+            have put it on the list already. '''
+        self.update(lambda users: ([user] + [u for u in users
+                                             if u['id'] != user['id']])
+                    [:self.size])
+
+    def replace(self, user):
+        self.update(lambda users: [user if u['id'] == user['id'] else u
+                                   for u in users])
+
+    def remove(self, user_id):
+        ''' Reloads the list if 'user_id' was on it: the next user in line
+            comes from the database '''
+        feed = self.cache.get(KEY)
+        if feed is not None and \
+                any(u['id'] == user_id for u in feed['users']):
+            self.load()
+
+
+def init_sign_up_feed(app):
+    app.extensions['sign_up_feed'] = SignUpFeed(
+        make_cache(app.config),
+        app.config.get('LATEST_SIGN_UPS', 10),
+        app.config.get('LATEST_SIGN_UPS_MAX_AGE', 60))
+
+
+def sign_up_feed():
+    return current_app.extensions['sign_up_feed']
@@ -0,0 +1,46 @@
+import os
+import sys
+import pytest
+
+# the modules of the app are imported by name, as app.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as fyyur  # noqa: E402
+from models import db  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    fyyur.config.update(SQLALCHEMY_DATABASE_URI='sqlite://',
+                        SQLALCHEMY_ENGINE_OPTIONS={},
+                        WTF_CSRF_ENABLED=False,
+                        TESTING=True)
+    with fyyur.app_context():
+        db.create_all()
+        yield fyyur
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def count_queries(app):
+    ''' count_queries(function, *args) --> (result, number of statements
+        it ran) '''
+    from sqlalchemy import event
+
+    def count(function, *args):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *rest):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute',
+                     before_cursor_execute)
+        try:
+            result = function(*args)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        return result, len(statements)
+
+    return count
@@ -0,0 +1,53 @@
+'''
+    The venue/artist profile pages are loaded by queries.load_profile in
+    3 queries, whatever the number of shows and genres of the user.
+'''
+
+from datetime import datetime, timedelta
+import pytest
+from models import db, Users, Venues, Artists, Shows, Genres, User_genre
+from queries import load_profile
+
+PROFILE_QUERIES = 3
+
+
+def add_users(shows):
+    genres = [Genres(name=name) for name in ('Jazz', 'Blues', 'Rock n Roll')]
+    venue = Users(type='Venue', name='The Hall', city='Austin', state='TX')
+    venue.venue = Venues(address='1 Main St')
+    artist = Users(type='Artist', name='The Band', city='Austin', state='TX')
+    artist.artist = Artists()
+    db.session.add_all(genres + [venue, artist])
+    db.session.flush()
+    artist.genres = [User_genre(genre_id=genre.id) for genre in genres]
+    venue.genres = [User_genre(genre_id=genres[0].id)]
+
+    now = datetime(2031, 6, 1, 20)
+    db.session.add_all([Shows(artist_id=artist.id, venue_id=venue.id,
+                              start_time=now + timedelta(days=day))
+                        for day in range(-(shows // 2), shows - shows // 2)])
+    db.session.commit()
+    return venue.id, artist.id, now
+
+
+@pytest.mark.parametrize('shows', [0, 1, 50])
+@pytest.mark.parametrize('user_type', ['Venue', 'Artist'])
+def test_profile_query_budget(app, count_queries, shows, user_type):
+    venue_id, artist_id, now = add_users(shows)
+    user_id = venue_id if user_type == 'Venue' else artist_id
+
+    data, queries = count_queries(load_profile, user_id, user_type, now)
+
+    assert queries <= PROFILE_QUERIES
+    assert len(data['past_shows']) + len(data['upcoming_shows']) == shows
+    assert data['past_shows_count'] == len(data['past_shows'])
+    assert data['upcoming_shows_count'] == len(data['upcoming_shows'])
+
+
+def test_unknown_profile(app, count_queries):
+    venue_id, _, now = add_users(1)
+
+    data, queries = count_queries(load_profile, venue_id, 'Artist', now)
+
+    assert data is None
+    assert queries <= PROFILE_QUERIES